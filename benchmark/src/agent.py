@@ -0,0 +1,236 @@
+import argparse
+import asyncio
+import base64
+import bench
+import json
+import limits
+import numpy as np
+import readiness
+import socket
+import struct
+import time
+from array import array
+from histogram import Histogram, Timeline
+from math import ceil
+
+
+# Distributed load generation: agents (started independently, e.g. on other hosts) run the bench workers, and the
+# coordinator (bench.bench with agents) splits the connections among them and merges their results.
+# Control protocol over TCP, one connection per run. Every message is a JSON object preceded by its length (4 bytes):
+#   coordinator -> {'type': 'time'}     agent -> {'type': 'time', 'time': <wall clock time>}
+#   coordinator -> {'type': 'run', ...} agent -> {'type': 'results', 'workers': [...]} or {'type': 'error', 'message': ...}
+# The coordinator estimates the clock offset of every agent from its fastest 'time' exchange, so that all of them
+# start at the same time (start_at, wall clock time of the agent). Only summaries (histograms, timelines, overhead)
+# are sent back, never raw samples
+AGENT_PORT = 7070
+CLOCK_PROBES = 8
+CONNECT_TIMEOUT = 10 # s
+START_DELAY = 2.0 # s between sending the run to the agents and their common start (time to start their workers)
+HEADER = struct.Struct('!I')
+TIMELINE_ARRAYS = ('counts', 'sums', 'offered', 'completed')
+
+
+def encode_array(a):
+    return base64.b64encode(a).decode()
+
+
+def decode_array(s):
+    return array('q', base64.b64decode(s))
+
+
+def encode_histogram(h):
+    return dict(h.state(), counts=encode_array(h.counts))
+
+
+def decode_histogram(d):
+    return Histogram.from_state(np.frombuffer(base64.b64decode(d['counts']), dtype=np.int64), d)
+
+
+def encode_result(result):
+    worker_id, h, t, n, overhead, e_abort, e_reconnect, phases = result
+    return {
+        'worker_id': worker_id,
+        'histogram': encode_histogram(h),
+        'timeline': dict({name: encode_array(getattr(t, name)) for name in TIMELINE_ARRAYS}, histograms=encode_array(t.histogram_entries()), epoch=t.epoch, interval=t.interval) if t is not None else None,
+        'n_samples': n,
+        'overhead': dict(overhead, lag=encode_histogram(overhead['lag'])),
+        'error_abort': e_abort,
+        'error_reconnect': e_reconnect,
+        'phases': {name: encode_histogram(phase) for name, phase in phases.items()},
+    }
+
+
+def decode_result(d):
+    t = None
+    if d['timeline'] is not None:
+        t = Timeline(d['timeline']['epoch'], d['timeline']['interval'], 0)
+        for name in TIMELINE_ARRAYS:
+            setattr(t, name, decode_array(d['timeline'][name]))
+        t.set_histograms(np.frombuffer(base64.b64decode(d['timeline']['histograms']), dtype=np.int64))
+    overhead = dict(d['overhead'], lag=decode_histogram(d['overhead']['lag']))
+    phases = {name: decode_histogram(phase) for name, phase in d['phases'].items()}
+    return d['worker_id'], decode_histogram(d['histogram']), t, d['n_samples'], overhead, d['error_abort'], d['error_reconnect'], phases
+
+
+def parse_address(address, default_port=AGENT_PORT):
+    # 'host:port' or 'host' -> (host, port)
+    if ':' not in address:
+        return address, default_port
+    host, _, port = address.rpartition(':')
+    return host, int(port)
+
+
+# Coordinator side (asyncio streams)
+async def write_message(writer, message):
+    data = json.dumps(message).encode()
+    writer.write(HEADER.pack(len(data)) + data)
+    await writer.drain()
+
+
+async def read_message(reader):
+    size, = HEADER.unpack(await reader.readexactly(HEADER.size))
+    return json.loads(await reader.readexactly(size))
+
+
+async def clock_offset(reader, writer):
+    # Agent clock - coordinator clock (s), from the exchange with the shortest round trip
+    best = None
+    for _ in range(CLOCK_PROBES):
+        t0 = time.time()
+        await write_message(writer, {'type': 'time'})
+        message = await read_message(reader)
+        t1 = time.time()
+        if best is None or t1 - t0 < best[0]:
+            best = (t1 - t0, message['time'] - (t0 + t1) / 2)
+    return best[1]
+
+
+async def run_agent(address, reader, writer, message):
+    await write_message(writer, message)
+    reply = await read_message(reader)
+    writer.close()
+    if reply['type'] == 'error':
+        raise RuntimeError(f"Agent {address} failed: {reply['message']}")
+    return [decode_result(r) for r in reply['workers']]
+
+
+async def run_agents(agents, config, connections, processes, conns_per_loop):
+    # Split the connections evenly among the agents and run them from a common start. Returns the results of all
+    # their workers, numbered consecutively
+    if len(set(map(parse_address, agents))) < len(agents):
+        raise ValueError(f"Duplicate agents in {agents}, every agent runs one share of the connections.")
+    links = []
+    for address in agents:
+        try:
+            async with asyncio.timeout(CONNECT_TIMEOUT):
+                reader, writer = await asyncio.open_connection(*parse_address(address))
+                links.append((address, reader, writer, await clock_offset(reader, writer)))
+        except TimeoutError:
+            raise RuntimeError(f"Agent {address} did not answer within {CONNECT_TIMEOUT} s (busy with another coordinator?).")
+
+    start_at = time.time() + START_DELAY
+    runs = []
+    first_id = 0
+    for i, (address, reader, writer, offset) in enumerate(links):
+        share = connections // len(links) + (i < connections % len(links))
+        if share == 0:
+            writer.close()
+            continue
+        message = {
+            'type': 'run',
+            'config': dict(config, ramp=config['ramp'] * share / connections, start_at=start_at + offset),
+            'connections': share,
+            'first_id': first_id,
+            'processes': ceil(processes / len(links)) if processes else None,
+            'conns_per_loop': conns_per_loop,
+        }
+        runs.append(run_agent(address, reader, writer, message))
+        first_id += share
+
+    results = []
+    for agent_results in await asyncio.gather(*runs):
+        for result in agent_results:
+            results.append((len(results), *result[1:]))
+    return results
+
+
+# Agent side (blocking sockets, one coordinator at a time)
+def send_message(sock, message):
+    data = json.dumps(message).encode()
+    sock.sendall(HEADER.pack(len(data)) + data)
+
+
+def recv_message(sock):
+    size, = HEADER.unpack(readiness.recv_exactly(sock, HEADER.size))
+    return json.loads(readiness.recv_exactly(sock, size))
+
+
+def run(message, cpus=None, sources=None):
+    # Run this agent's share of the connections with its own workers
+    config = dict(message['config'], cpus=cpus)
+    if sources:
+        config['sources'] = sources # Addresses of this host
+    connections = message['connections']
+    limits.preflight(connections, config['host'], config['sources'], config['ports'])
+    n_processes = bench.n_workers(connections, message['processes'], message['conns_per_loop'], cpus)
+    workers, _, results_q = bench.start_workers(config, connections, n_processes, message['first_id'])
+    return bench.gather_workers(workers, results_q)
+
+
+def serve(host, port, cpus=None, sources=None):
+    with socket.create_server((host, port)) as server:
+        print(f"Agent listening on {host}:{port}")
+        while True:
+            sock, peer = server.accept()
+            with sock:
+                try:
+                    while True:
+                        message = recv_message(sock)
+                        if message['type'] == 'time':
+                            send_message(sock, {'type': 'time', 'time': time.time()})
+                        elif message['type'] == 'run':
+                            print(f"Running {message['connections']} {message['config']['workload']} connections for {peer[0]}")
+                            try:
+                                results = run(message, cpus, sources)
+                                send_message(sock, {'type': 'results', 'workers': [encode_result(r) for r in results]})
+                            except Exception as e:
+                                send_message(sock, {'type': 'error', 'message': repr(e)})
+                except ConnectionError:
+                    pass # Coordinator done (or gone)
+
+
+if __name__ == "__main__":
+    # Parse arguments
+    parser = argparse.ArgumentParser()
+
+    # Listening address
+    parser.add_argument(
+        '-L', '--listen',
+        type=str,
+        default=f"0.0.0.0:{AGENT_PORT}",
+        help=f"Address the agent waits for the coordinator on. Default is 0.0.0.0:{AGENT_PORT}.",
+        dest="listen"
+    )
+
+    # Worker CPUs
+    parser.add_argument(
+        '--cpus',
+        type=bench.parse_ranges,
+        required=False,
+        help="CPUs of this host to pin the load generator processes to (one CPU each, round robin), e.g. '0-3'.",
+        dest="cpus"
+    )
+
+    # Source addresses
+    parser.add_argument(
+        '--sources',
+        type=limits.parse_sources,
+        required=False,
+        help="Local addresses and networks of this host to open the connections from. By default, the ones given to the coordinator.",
+        dest="sources"
+    )
+
+    args = parser.parse_args()
+
+    host, port = parse_address(args.listen)
+    serve(host, port, args.cpus, args.sources)
@@ -1,115 +1,740 @@
+import argparse
+import bootstrap
+import itertools
+import matplotlib
+matplotlib.use('Agg') # Figures are only saved, from worker processes
 import matplotlib.pyplot as plt
+import netstat
 import numpy as np
 import os
 import pandas as pd
 import pickle
+import storage
+import sys
+from concurrent.futures import ProcessPoolExecutor
+from histogram import Histogram, compact_counts, counts_percentiles, dense_rows, expand_counts
+from steady_state import steady_state
+from telemetry import summarize_telemetry
 from pathlib import Path
 
 
 NATIVE_COLOR = 'darkorange'
 WASM_COLOR = '#654ff0'
+CALIBRATION_COLOR = 'gray' # Stand-in servers (main.py --calibrate): the limits of the load generator
+SERIES_COLORS = [c for i, c in enumerate(plt.cm.tab10.colors) if i not in (1, 4)] # Other runtime configurations (tab10 without its orange and purple)
 
 
-def gather_results():
-    columns = {
-        'type': [],
-        'number of connections': [],
-        'number of requests': [],
-        'throughput (req/s)': [],
-        'latency mean (s)': [],
-        'latency std (s)': [],
-        'latency min (s)': [],
-        'latency max (s)': [],
-        'tail latency 95% (s)': [],
-        'tail latency 99% (s)': [],
-        'tail latency 99.9% (s)': [],
-        'error_abort': [],
-        'error_reconnect': [],
+COLUMNS = [
+    'session',
+    'type',
+    'series',
+    'number of connections',
+    'requests in flight per connection',
+    'offered load (req/s)',
+    'trial',
+    'number of requests',
+    'throughput (req/s)',
+    'latency mean (s)',
+    'latency std (s)',
+    'latency min (s)',
+    'latency max (s)',
+    'tail latency 95% (s)',
+    'tail latency 99% (s)',
+    'tail latency 99.9% (s)',
+    'error_abort',
+    'error_reconnect',
+    'generator bound',
+    'max generator cpu',
+    'max generator loop lag p99 (s)',
+    'max generator pending tasks',
+]
+TELEMETRY_COLUMNS = [
+    'server cpu (cores)',
+    'server user cpu share',
+    'server cpu per request (s)',
+    'server peak rss (MiB)',
+    'server peak pss (MiB)',
+    'server rss per connection (KiB)',
+    'server threads',
+    'server voluntary ctxt switches/s',
+    'server nonvoluntary ctxt switches/s',
+    'server fds',
+]
+STEADY_STATE_COLUMNS = [
+    'steady state start (s)',
+    'steady state end (s)',
+    'steady state throughput (req/s)',
+    'steady state latency mean (s)',
+    'steady state tail latency 95% (s)',
+    'steady state tail latency 99% (s)',
+    'steady state tail latency 99.9% (s)',
+]
+COLD_START_COLUMNS = [
+    'time to accept (s)',
+    'time to first response (s)',
+]
+# Network stack over the run (see netstat.Snapshots): counter changes, then sockets of the benchmarked ports (both
+# ends of every connection are counted when the load generator runs on the same host)
+NETWORK_COLUMNS = list(netstat.NETWORK_COUNTERS.values()) + [
+    'established sockets during run',
+    'syn recv sockets during run',
+    'time wait sockets after run',
+]
+# Short-lived connections (bench.py --churn): the connections themselves, besides the requests they carry
+CHURN_COLUMNS = [
+    'max requests per connection',
+    'connection rate (conn/s)',
+    'connection throughput (conn/s)',
+    'connect latency mean (s)',
+    *[f'connect latency {p}% (s)' for p in [95, 99, 99.9]],
+    'time to first byte mean (s)',
+    *[f'time to first byte {p}% (s)' for p in [95, 99, 99.9]],
+]
+# Columns identifying a run point, whose trials (--repeat) are aggregated, and the ones they get confidence intervals for
+POINT_COLUMNS = [
+    'workload',
+    'session',
+    'type',
+    'series',
+    'number of connections',
+    'requests in flight per connection',
+    'offered load (req/s)',
+    'max requests per connection',
+]
+CI_COLUMNS = [
+    'throughput (req/s)',
+    'latency mean (s)',
+    'tail latency 95% (s)',
+    'tail latency 99% (s)',
+    'tail latency 99.9% (s)',
+]
+PERCENTILES = [95, 99, 99.9]
+SPECTRUM_PERCENTILES = np.concatenate([np.arange(0, 90), 100 * (1 - np.logspace(-1, -4, 61))]) # Up to p99.99
+FIGURE_DIRS = ['throughput', 'tail_latencies', 'overhead', 'resources', 'network', 'churn', 'timeseries', 'distributions']
+REGRESSION_THRESHOLD = 0.05
+CACHE_VERSION = 14 # Increase when the summary of a run changes, so that cached summaries are recomputed
+
+
+def summarize_timeline(path, meta):
+    # Steady state columns and time series of a run from its timeline. Times are in s from the start of the run
+    # (older runs only have a timeline of the measurement phase, which starts after the fixed warmup)
+    timeline = storage.load_column(path, 'timeline')
+    if timeline is None or not meta.get('timeline_interval'):
+        return {}, None, None
+    # Histograms of the intervals, stored as their nonzero buckets (older runs stored them whole)
+    histograms = storage.load_column(path, 'interval_histograms_sparse')
+    if histograms is not None:
+        histograms = dense_rows(histograms, len(timeline))
+    else:
+        histograms = storage.load_column(path, 'interval_histograms')
+    interval = meta['timeline_interval']
+    counts, sums = np.asarray(timeline[:, 0]), np.asarray(timeline[:, 1])
+    start, end = steady_state(counts, sums)
+    n = counts[start:end].sum()
+    offset = meta['warmup'] + meta.get('timeline_start', 0)
+    if meta.get('profile'):
+        # The load changes on purpose, there is no steady state to look for
+        start, end = 0, len(counts)
+    row = {
+        'steady state start (s)': offset + start * interval,
+        'steady state end (s)': offset + end * interval,
+        'steady state throughput (req/s)': n / ((end - start) * interval) if end > start else np.nan,
+        'steady state latency mean (s)': sums[start:end].sum() / n * 1e-9 if n else np.nan,
+    }
+    p99 = np.full(len(counts), np.nan)
+    steady_counts = None
+    if histograms is not None:
+        steady_counts = np.asarray(histograms[start:end]).sum(axis=0)
+        ps = counts_percentiles(steady_counts, PERCENTILES)
+        for p, x in zip(PERCENTILES, ps):
+            row[f'steady state tail latency {p}% (s)'] = x * 1e-9
+        p99 = counts_percentiles(histograms, [99])[:, 0] * 1e-9
+    if meta.get('profile'):
+        row = {}
+        steady_counts = None
+    timeseries = {
+        'time (s)': offset + np.arange(len(counts)) * interval,
+        'throughput (req/s)': counts / interval,
+        'offered (req/s)': None,
+        'tail latency 99% (s)': p99,
+        'steady state': (start, end),
+        'warmup (s)': meta['warmup'],
+        'profile': meta.get('profile'),
     }
-    index = []#machine learning (native) 
+    # Offered and achieved (completed) load, recorded since load profiles
+    if timeline.shape[1] >= 4:
+        timeseries['offered (req/s)'] = np.asarray(timeline[:, 2]) / interval
+        timeseries['throughput (req/s)'] = np.asarray(timeline[:, 3]) / interval
+    return row, timeseries, steady_counts
+
+
+def summarize_run(path, w_name, session):
+    # Row of the processed data for one run, its time series (None without a timeline) and its latency distribution
+    # (compact histograms, None for the raw latencies stored by older versions)
+    counts = None
+    if storage.is_run(path):
+        meta = storage.load_meta(path)
+        h = Histogram.from_state(storage.load_column(path, 'histogram'), meta['histogram'])
+        n = h.total
+        mean, std, lo, hi, ps = h.summary(PERCENTILES)
+        stats = [mean, std, lo, hi, *ps]
+        counts = h.counts
+    else:
+        # Results stored as pickles by older versions
+        file = open(path, 'rb')
+        meta = pickle.load(file)
+        file.close()
+        if 'histogram' in meta:
+            h = meta['histogram']
+            n = h.total
+            mean, std, lo, hi, ps = h.summary(PERCENTILES)
+            stats = [mean, std, lo, hi, *ps]
+            counts = h.counts
+        else:
+            ls = np.asarray(meta['latencies'], dtype=np.int64).reshape(-1, 2)[:, 1]
+            n = len(ls)
+            stats = [np.mean(ls), np.std(ls), np.min(ls), np.max(ls), *np.percentile(ls, PERCENTILES)]
+
+    row = {
+        'workload': w_name,
+        'session': session,
+        'type': meta['type'],
+        'series': meta.get('series', meta['type']),
+        'number of connections': meta['connections'],
+        'requests in flight per connection': meta.get('window', 1),
+        'offered load (req/s)': meta['rate'] if meta.get('rate') is not None else np.nan,
+        'trial': meta.get('trial', 0),
+        'number of requests': n,
+        'throughput (req/s)': n / meta['duration'],
+        'error_abort': meta['error_abort'],
+        'error_reconnect': meta['error_reconnect'],
+        'generator bound': meta.get('generator_bound', False),
+        'max generator cpu': max(meta['worker_cpu']) if meta.get('worker_cpu') else np.nan,
+        'max generator loop lag p99 (s)': max(meta['worker_lag_p99']) if meta.get('worker_lag_p99') else np.nan,
+        'max generator pending tasks': max(meta['worker_tasks_max']) if meta.get('worker_tasks_max') else np.nan,
+    }
+    for column, x in zip(COLUMNS[COLUMNS.index('latency mean (s)'):], stats):
+        row[column] = x * 1e-9 # Convert from ns to s
+
+    # Cold start of the server (time from launch until it accepted a connection and answered a first request)
+    cold_start = meta.get('cold_start') or {}
+    row['time to accept (s)'] = cold_start.get('time_to_accept', np.nan)
+    row['time to first response (s)'] = cold_start.get('time_to_first_response') or np.nan
+
+    # Churn: connect latency and time to first byte of every connection. The offered load of an open-loop churn run
+    # is its connection rate times the mean requests per connection
+    if meta.get('churn') is not None:
+        row['max requests per connection'] = meta['churn']
+        if meta.get('connection_rate') is not None:
+            row['connection rate (conn/s)'] = meta['connection_rate']
+            row['offered load (req/s)'] = meta['connection_rate'] * (meta['churn'] + 1) / 2
+        for name, label in [('connect', 'connect latency'), ('ttfb', 'time to first byte')]:
+            if name in meta.get('phases', {}):
+                phase = Histogram.from_state(storage.load_column(path, f'{name}_histogram'), meta['phases'][name])
+                mean, _, _, _, ps = phase.summary(PERCENTILES)
+                row[f'{label} mean (s)'] = mean * 1e-9
+                row.update({f'{label} {p}% (s)': x * 1e-9 for p, x in zip(PERCENTILES, ps)})
+                if name == 'connect':
+                    row['connection throughput (conn/s)'] = phase.total / meta['duration']
+
+    # Network stack: accept queue overflows, retransmits and resets tell network bottlenecks from runtime ones
+    network = meta.get('network')
+    if network is not None:
+        row.update({k: v if v is not None else np.nan for k, v in network['counters'].items()})
+        during = network['sockets'].get('during') # Missing for runs shorter than the timer
+        row['established sockets during run'] = during.get('ESTABLISHED', 0) if during is not None else np.nan
+        row['syn recv sockets during run'] = during.get('SYN_RECV', 0) if during is not None else np.nan
+        row['time wait sockets after run'] = network['sockets']['after'].get('TIME_WAIT', 0)
+
+    # Resource usage of the server
+    server_telemetry = storage.load_column(path, 'telemetry') if path.is_dir() else None
+    if server_telemetry is not None:
+        row.update(summarize_telemetry(server_telemetry, meta.get('warmup', 0), meta['duration'], n, meta['connections']))
+
+    # Steady state, detected from the throughput and latency over time instead of a fixed warmup share
+    timeseries = None
+    steady_counts = None
+    if path.is_dir():
+        steady, timeseries, steady_counts = summarize_timeline(path, meta)
+        row.update(steady)
+    point = {k: row[k] for k in ('workload', 'series', 'number of connections', 'offered load (req/s)', 'generator bound')}
+    if timeseries is not None:
+        timeseries.update(point)
+
+    distribution = None
+    if counts is not None:
+        distribution = dict(point, **{
+            'histogram': compact_counts(counts),
+            'steady state histogram': compact_counts(steady_counts) if steady_counts is not None else None,
+        })
+    return row, timeseries, distribution
+
+
+def select_sessions(labels=None):
+    # Session folders to analyse: the given labels, by default the latest session. Results stored without sessions by
+    # older versions are analysed if there is no session at all
+    if labels:
+        return [storage.RAW_DATA_DIR / label for label in labels]
+    sessions = storage.sessions()
+    return sessions[-1:] if sessions else [storage.RAW_DATA_DIR]
+
+
+def gather_results(labels=None):
     results_dir = Path(__file__).parents[1] / "results"
+    raw_data_dir = storage.RAW_DATA_DIR
+    processed_dir = results_dir / "processed_data"
 
-    raw_data_dir = results_dir / "raw_data"
-    for w_dir in raw_data_dir.iterdir():
-        if w_dir.is_dir():
+    # Summaries of previously processed runs, keyed by their path and validated by fingerprint (mtime and size)
+    # and, if that changed, by content hash. Only new or changed runs are processed again
+    cache_path = processed_dir / "summary_cache.pkl"
+    cache = {}
+    if cache_path.exists():
+        file = open(cache_path, 'rb')
+        cache = pickle.load(file)
+        file.close()
+        if cache.pop('version', None) != CACHE_VERSION:
+            cache = {}
+
+    rows = []
+    timeseries = []
+    distributions = []
+    new_cache = {'version': CACHE_VERSION}
+    for session_dir in select_sessions(labels):
+        session = session_dir.name if session_dir != raw_data_dir else ''
+        for w_dir, path in storage.iter_runs(session_dir):
             w_name = ' '.join(w_dir.name.split('_'))
-            for datafile in w_dir.iterdir():
-                if datafile.suffix == '.pkl':
-                    file = open(datafile, 'rb')
-                    raw_data = pickle.load(file)
-                    file.close()
-
-                    index.append(w_name)
-                    columns['type'].append(raw_data['type'])
-                    columns['number of connections'].append(raw_data['connections'])
-
-                    ls = list(l[1] * 1e-9 for l in raw_data['latencies']) # Convert from ns to s
-                    columns['number of requests'].append(len(ls))
-                    columns['throughput (req/s)'].append(len(ls) / raw_data['duration'])
-                    columns['latency mean (s)'].append(np.mean(ls))
-                    columns['latency std (s)'].append(np.std(ls))
-                    columns['latency min (s)'].append(min(ls))
-                    columns['latency max (s)'].append(max(ls))
-                    columns['tail latency 95% (s)'].append(np.percentile(ls, 95))
-                    columns['tail latency 99% (s)'].append(np.percentile(ls, 99))
-                    columns['tail latency 99.9% (s)'].append(np.percentile(ls, 99.9))
-
-                    columns['error_abort'].append(raw_data['error_abort'])
-                    columns['error_reconnect'].append(raw_data['error_reconnect'])
+            key = str(path.relative_to(raw_data_dir))
+            fp = storage.fingerprint(path)
+            entry = cache.get(key)
+            if entry is None or entry['fingerprint'] != fp:
+                d = storage.digest(path)
+                if entry is None or entry['digest'] != d:
+                    row, ts, distribution = summarize_run(path, w_name, session)
+                    entry = {'digest': d, 'row': row, 'timeseries': ts, 'distribution': distribution}
+                entry['fingerprint'] = fp
+            new_cache[key] = entry
+            rows.append(entry['row'])
+            if entry['timeseries'] is not None:
+                timeseries.append(entry['timeseries'])
+            if entry['distribution'] is not None:
+                distributions.append(entry['distribution'])
+
+    # Keep the summaries of sessions that were not analysed this time
+    for key, entry in cache.items():
+        if key not in new_cache and (raw_data_dir / key).exists():
+            new_cache[key] = entry
 
     # Create dataframe
-    df = pd.DataFrame(data=columns, index=index)
-    df.index.name = 'workload'
-    df.sort_values(by=['workload', 'type', 'number of connections'], inplace=True)
+    df = pd.DataFrame(rows, columns=['workload'] + COLUMNS + STEADY_STATE_COLUMNS + COLD_START_COLUMNS + TELEMETRY_COLUMNS + NETWORK_COLUMNS + CHURN_COLUMNS).set_index('workload')
+    df.sort_values(by=['workload', 'type', 'series', 'number of connections', 'offered load (req/s)', 'trial'], inplace=True)
+
+    # Store processed data and cache
+    storage.atomic_write(processed_dir / "processed_data.pkl", lambda file: pickle.dump(df, file))
+    storage.atomic_write(processed_dir / "timeseries.pkl", lambda file: pickle.dump(timeseries, file))
+    storage.atomic_write(processed_dir / "distributions.pkl", lambda file: pickle.dump(distributions, file))
+    storage.atomic_write(cache_path, lambda file: pickle.dump(new_cache, file))
+
+
+def steady_state_results(df):
+    # Summaries over the steady state detected in every run (where there is a timeline) instead of the fixed warmup share
+    df = df.copy()
+    for column in CI_COLUMNS:
+        df[column] = df[f'steady state {column}'].fillna(df[column])
+    return df
+
+
+def aggregate_trials(df):
+    # One row per run point: the mean of its trials, and bootstrap confidence intervals where there are several
+    rows = []
+    for point, trials in df.reset_index().groupby(POINT_COLUMNS, dropna=False, sort=False):
+        row = dict(zip(POINT_COLUMNS, point))
+        row.update(trials.drop(columns=POINT_COLUMNS + ['trial']).mean(numeric_only=True))
+        row['trials'] = len(trials)
+        for column in CI_COLUMNS:
+            row[f'{column} ci low'], row[f'{column} ci high'] = bootstrap.confidence_interval(trials[column])
+        rows.append(row)
+    if not rows:
+        return pd.DataFrame(columns=POINT_COLUMNS).set_index('workload')
+    return pd.DataFrame(rows).set_index('workload')
+
+
+def compare(base, new, threshold=REGRESSION_THRESHOLD, fixed_warmup=False):
+    # Compare the run points of two sessions (e.g. before and after a runtime upgrade). A point regressed if its
+    # throughput dropped, or its p99 latency rose, by more than threshold over the whole confidence interval of the
+    # change, so that differences within the noise between trials are not flagged. Returns the number of regressions
+    processed_dir = Path(__file__).parents[1] / "results" / "processed_data"
+    df = pd.read_pickle(processed_dir / "processed_data.pkl")
+    if not fixed_warmup:
+        df = steady_state_results(df)
+    df = df.reset_index().fillna({'offered load (req/s)': 0, 'max requests per connection': 0}) # Closed loop, long-lived connections
+    key = [c for c in POINT_COLUMNS if c != 'session']
+    base_points = dict(iter(df[df['session'] == base].groupby(key)))
+
+    rows = []
+    for point, new_trials in df[df['session'] == new].groupby(key):
+        base_trials = base_points.get(point)
+        if base_trials is None:
+            continue
+        row = dict(zip(key, point), **{'base trials': len(base_trials), 'new trials': len(new_trials)})
+        for column, worse in [('throughput (req/s)', -1), ('tail latency 99% (s)', 1)]:
+            change, lo, hi = bootstrap.relative_change(base_trials[column], new_trials[column])
+            row[f'{column} change'], row[f'{column} change ci low'], row[f'{column} change ci high'] = change, lo, hi
+            row[f'{column} regression'] = bool(min(lo * worse, hi * worse) > threshold)
+        row['regression'] = row['throughput (req/s) regression'] or row['tail latency 99% (s) regression']
+        rows.append(row)
+
+        load = f"{row['offered load (req/s)']:g} req/s" if row['offered load (req/s)'] else f"{row['number of connections']} connections"
+        if row['max requests per connection']:
+            load += f" (churn {row['max requests per connection']:g})"
+        changes = ', '.join(f"{name} {row[f'{column} change']:+.1%} [{row[f'{column} change ci low']:+.1%}, {row[f'{column} change ci high']:+.1%}]" for column, name in [('throughput (req/s)', 'throughput'), ('tail latency 99% (s)', 'p99')])
+        print(f"{row['workload']} [{row['series']}] {load}: {changes}" + (" REGRESSION" if row['regression'] else ""))
+
+    if not rows:
+        print(f"No run points in common between sessions {base} and {new}.")
+        return 0
+    comparison = pd.DataFrame(rows)
+    if (comparison[['base trials', 'new trials']] < 2).any(axis=None):
+        print("Warning: points with less than 2 trials in a session have no confidence interval and are never flagged (use --repeat).")
+    storage.atomic_write(processed_dir / "comparison.csv", lambda file: file.write(comparison.to_csv(index=False).encode()))
+    regressions = int(comparison['regression'].sum())
+    print(f"{regressions} regression(s) out of {len(comparison)} run points (threshold {threshold:.1%}).")
+    return regressions
+
+
+def error_band(df_s, x, column, color):
+    # Bootstrap confidence interval of a column over the trials of every point, if it has several
+    if df_s[f'{column} ci low'].notna().any():
+        plt.fill_between(df_s[x], df_s[f'{column} ci low'], df_s[f'{column} ci high'], color=color, alpha=0.2, linewidth=0)
+
+
+def series_colors(series):
+    # Native and plain wasm keep their colors, every other series gets the next one of the palette
+    colors = {'native': NATIVE_COLOR, 'wasm': WASM_COLOR, 'calibration': CALIBRATION_COLOR}
+    others = itertools.cycle(SERIES_COLORS)
+    return {s: colors[s] if s in colors else next(others) for s in series}
+
 
-    # Store processed data
-    path = raw_data_dir = results_dir / "processed_data" / "processed_data.pkl"
-    file = open(path, 'wb')
-    pickle.dump(df, file)
-    file.close()
+def series_label(series):
+    if series == 'calibration':
+        return 'Load generator (stand-in)'
+    return series.capitalize() if series in ('native', 'wasm') else series
 
 
-def draw_graphs():
+def level_label(level):
+    # Load level (connections, offered load) of a run in legends and file names
+    connections, rate = level
+    return (f"{rate:g} req/s" if not np.isnan(rate) else f"{connections} conn."), (f"r{rate:g}" if not np.isnan(rate) else f"c{connections}")
+
+
+def draw_timeseries(w_name, s, runs, timeseries_dir):
+    # Throughput and p99 latency over time of every run of a workload and series, one line per load level: the
+    # detected steady state solid, the transients faded, and the end of the fixed warmup marked. The offered load
+    # is dashed where it was recorded
+    fig, axs = plt.subplots(2, 1, figsize=(10, 8), sharex=True)
+    colors = itertools.cycle(plt.cm.viridis(np.linspace(0, 0.9, len(runs))))
+    runs.sort(key=lambda ts: (ts['number of connections'], np.nan_to_num(ts['offered load (req/s)'])))
+    for ts, color in zip(runs, colors):
+        load = level_label((ts['number of connections'], ts['offered load (req/s)']))[0]
+        if ts.get('profile'):
+            load += f" ({ts['profile']})"
+        start, end = ts['steady state']
+        if ts.get('offered (req/s)') is not None:
+            axs[0].plot(ts['time (s)'], ts['offered (req/s)'], '--', color=color, linewidth=1)
+        for ax, column in zip(axs, ('throughput (req/s)', 'tail latency 99% (s)')):
+            ax.plot(ts['time (s)'], ts[column], '-', color=color, alpha=0.3)
+            ax.plot(ts['time (s)'][start:end], ts[column][start:end], '-', color=color, label=load)
+    for ax, label in zip(axs, ('Throughput (req/s)', 'Tail Latency 99% (s)')):
+        ax.axvline(runs[0]['warmup (s)'], color='gray', linestyle='--', linewidth=1)
+        ax.set_ylabel(label)
+        ax.grid()
+    axs[0].set_title(f"{w_name} ({series_label(s)})")
+    axs[0].legend(loc='best', fontsize='small')
+    axs[1].set_xlabel('Time (s)')
+    fig.tight_layout()
+    fig.savefig(timeseries_dir / f"{'_'.join(w_name.split(' '))}_{s}_timeseries.png")
+    plt.close(fig)
+
+
+def draw_distribution(title, lines, path):
+    # Latency CDF and percentile spectrum (HDR style: the distance to 100% on a log scale, up to p99.99) of
+    # (label, color, histogram counts) lines
+    fig, (ax_cdf, ax_spectrum) = plt.subplots(1, 2, figsize=(14, 5))
+    for label, color, counts in lines:
+        values = counts_percentiles(counts, SPECTRUM_PERCENTILES) * 1e-9
+        ax_cdf.plot(values, SPECTRUM_PERCENTILES / 100, '-', color=color, label=label)
+        ax_spectrum.plot(100 / (100 - SPECTRUM_PERCENTILES), values, '-', color=color, label=label)
+    ax_cdf.set_xscale('log')
+    ax_cdf.set_xlabel('Latency (s)')
+    ax_cdf.set_ylabel('Cumulative Probability')
+    ax_spectrum.set_xscale('log')
+    ax_spectrum.set_xticks([1, 10, 100, 1000, 10000], ['0%', '90%', '99%', '99.9%', '99.99%'])
+    ax_spectrum.set_xlabel('Percentile')
+    ax_spectrum.set_ylabel('Latency (s)')
+    for ax in (ax_cdf, ax_spectrum):
+        ax.grid(which='both', alpha=0.5)
+    ax_cdf.legend(loc='best', fontsize='small')
+    fig.suptitle(title)
+    fig.tight_layout()
+    fig.savefig(path)
+    plt.close(fig)
+
+
+def distribution_jobs(distributions, distributions_dir, fixed_warmup=False):
+    # (title, lines, path) of the distribution figures: per workload and series, one line per load level, and per
+    # workload and load level, one line per series. Trials (and sessions) of the same run point are pooled
+    pooled = {}
+    for d in distributions:
+        compact = d['steady state histogram'] if d['steady state histogram'] is not None and not fixed_warmup else d['histogram']
+        key = (d['workload'], d['series'], (d['number of connections'], d['offered load (req/s)']))
+        pooled[key] = pooled.get(key, 0) + expand_counts(compact)
+
+    jobs = []
+    for w_name in sorted({k[0] for k in pooled}):
+        file_prefix = '_'.join(w_name.split(' '))
+        series = sorted({k[1] for k in pooled if k[0] == w_name}, key=lambda s: (s != 'native', s != 'wasm', s))
+        levels = sorted({k[2] for k in pooled if k[0] == w_name}, key=lambda l: (l[0], np.nan_to_num(l[1])))
+        colors = series_colors(series)
+        level_colors = dict(zip(levels, plt.cm.viridis(np.linspace(0, 0.9, len(levels)))))
+        for s in series:
+            lines = [(level_label(l)[0], level_colors[l], pooled[(w_name, s, l)]) for l in levels if (w_name, s, l) in pooled]
+            jobs.append((f"{w_name} ({series_label(s)})", lines, distributions_dir / f"{file_prefix}_{s}_distribution.png"))
+        for l in levels:
+            lines = [(series_label(s), colors[s], pooled[(w_name, s, l)]) for s in series if (w_name, s, l) in pooled]
+            jobs.append((f"{w_name} ({level_label(l)[0]})", lines, distributions_dir / f"{file_prefix}_{level_label(l)[1]}_distribution.png"))
+    return jobs
+
+
+def draw_workload(w_name, df_w, figures_dir):
+    # Open-loop sweeps are plotted against the offered load (the connection rate for churn) instead of the number of connections
+    if df_w['connection rate (conn/s)'].notna().all():
+        x, x_label = 'connection rate (conn/s)', 'Connection Rate (conn/s)'
+    elif df_w['offered load (req/s)'].notna().all():
+        x, x_label = 'offered load (req/s)', 'Offered Load (req/s)'
+    else:
+        x, x_label = 'number of connections', 'Number of Connections'
+    file_prefix = '_'.join(w_name.split(' '))
+
+    # One line per runtime configuration (series), native first
+    series = sorted(df_w['series'].unique(), key=lambda s: (s != 'native', s != 'wasm', s))
+    colors = series_colors(series)
+
+    # Throughput
+    for s in series:
+        plt.plot(x, 'throughput (req/s)', 's-', data=df_w[df_w['series'] == s], label=series_label(s), color=colors[s])
+        error_band(df_w[df_w['series'] == s], x, 'throughput (req/s)', colors[s])
+    plt.xlabel(x_label)
+    plt.ylabel('Throughput (req/s)')
+    plt.legend(loc='best')
+    plt.grid()
+    plt.savefig(figures_dir / "throughput" / f"{file_prefix}_throughput.png")
+    plt.close()
+
+    # Tail latencies
+    lw = 1.2
+    ms = 7
+    for s in series:
+        for p,m in [('95', 's'), ('99', '^'), ('99.9', 'o')]:
+            plt.plot(x, f'tail latency {p}% (s)', f'{m}-', data=df_w[df_w['series'] == s], label=f'{series_label(s)} {p}%', color=colors[s], markerfacecolor='none', linewidth=lw, markersize=ms)
+            error_band(df_w[df_w['series'] == s], x, f'tail latency {p}% (s)', colors[s])
+
+    plt.xlabel(x_label)
+    plt.ylabel('Tail Latency (s)')
+    plt.legend(loc='best')
+    plt.savefig(figures_dir / "tail_latencies" / f"{file_prefix}_tail_latencies.png")
+    plt.close()
+
+    # Overhead of every other series relative to native at the same load: throughput and latency ratios
+    ratio_columns = ['throughput (req/s)', 'latency mean (s)', 'tail latency 99% (s)', 'tail latency 99.9% (s)']
+    others = [s for s in series if s not in ('native', 'calibration')]
+    if 'native' in series and others:
+        native = df_w[df_w['series'] == 'native'].groupby(x)[ratio_columns].mean()
+        fig, (ax_throughput, ax_latency) = plt.subplots(1, 2, figsize=(14, 5))
+        for s in others:
+            ratio = df_w[df_w['series'] == s].groupby(x)[ratio_columns].mean() / native
+            ratio = ratio.dropna(how='all')
+            ax_throughput.plot(ratio.index, ratio['throughput (req/s)'], 's-', color=colors[s], label=series_label(s))
+            for column, m, label in [('latency mean (s)', 's', 'mean'), ('tail latency 99% (s)', '^', '99%'), ('tail latency 99.9% (s)', 'o', '99.9%')]:
+                ax_latency.plot(ratio.index, ratio[column], f'{m}-', color=colors[s], markerfacecolor='none', label=f'{series_label(s)} {label}')
+        for ax, label in [(ax_throughput, 'Throughput Ratio to Native'), (ax_latency, 'Latency Ratio to Native')]:
+            ax.axhline(1, color='gray', linestyle='--', linewidth=1)
+            ax.set_xlabel(x_label)
+            ax.set_ylabel(label)
+            ax.legend(loc='best', fontsize='small')
+            ax.grid()
+        fig.tight_layout()
+        fig.savefig(figures_dir / "overhead" / f"{file_prefix}_overhead.png")
+        plt.close(fig)
+
+    # Server resource usage
+    if df_w['server cpu (cores)'].notna().any():
+        fig, axs = plt.subplots(2, 3, figsize=(15, 8))
+        for ax, (column, label) in zip(axs.flat, [
+            ('server cpu (cores)', 'CPU (cores)'),
+            ('server cpu per request (s)', 'CPU Time per Request (s)'),
+            ('server peak rss (MiB)', 'Peak RSS (MiB)'),
+            ('server rss per connection (KiB)', 'Peak RSS per Connection (KiB)'),
+            ('server threads', 'Threads'),
+            ('server nonvoluntary ctxt switches/s', 'Involuntary Context Switches (1/s)'),
+        ]):
+            for s in series:
+                ax.plot(x, column, 's-', data=df_w[df_w['series'] == s], label=series_label(s), color=colors[s])
+            ax.set_xlabel(x_label)
+            ax.set_ylabel(label)
+            ax.grid()
+        axs.flat[0].legend(loc='best')
+        fig.tight_layout()
+        fig.savefig(figures_dir / "resources" / f"{file_prefix}_resources.png")
+        plt.close(fig)
+
+    # Short-lived connections: the cost of a connection (connect, then setup by the server until the first response)
+    # next to the latency of the requests
+    if df_w['time to first byte mean (s)'].notna().any():
+        fig, (ax_connect, ax_ttfb, ax_rate) = plt.subplots(1, 3, figsize=(18, 5))
+        for s in series:
+            df_s = df_w[df_w['series'] == s]
+            for ax, label in [(ax_connect, 'connect latency'), (ax_ttfb, 'time to first byte')]:
+                for p, m in [('mean', 's'), ('99%', '^'), ('99.9%', 'o')]:
+                    ax.plot(x, f'{label} {p} (s)', f'{m}-', data=df_s, label=f'{series_label(s)} {p}', color=colors[s], markerfacecolor='none')
+            ax_ttfb.plot(x, 'tail latency 99% (s)', '^--', data=df_s, label=f'{series_label(s)} request 99%', color=colors[s], markerfacecolor='none', alpha=0.6)
+            ax_rate.plot(x, 'connection throughput (conn/s)', 's-', data=df_s, label=series_label(s), color=colors[s])
+        for ax, label in [(ax_connect, 'Connect Latency (s)'), (ax_ttfb, 'Time to First Byte (s)'), (ax_rate, 'Connections per Second')]:
+            ax.set_xlabel(x_label)
+            ax.set_ylabel(label)
+            ax.legend(loc='best', fontsize='small')
+            ax.grid()
+        fig.tight_layout()
+        fig.savefig(figures_dir / "churn" / f"{file_prefix}_churn.png")
+        plt.close(fig)
+
+    # Network stack
+    if df_w['listen overflows'].notna().any():
+        fig, axs = plt.subplots(2, 2, figsize=(12, 8))
+        for ax, (columns, label) in zip(axs.flat, [
+            ([('listen overflows', 's'), ('listen drops', '^')], 'Accept Queue Drops'),
+            ([('syn retransmits', 's'), ('retransmitted segments', '^')], 'Retransmits'),
+            ([('resets sent', 's'), ('established resets', '^')], 'Resets'),
+            ([('established sockets during run', 's'), ('time wait sockets after run', '^')], 'Sockets'),
+        ]):
+            for s in series:
+                for column, m in columns:
+                    ax.plot(x, column, f'{m}-', data=df_w[df_w['series'] == s], label=f'{series_label(s)} {column}', color=colors[s], markerfacecolor='none')
+            ax.set_xlabel(x_label)
+            ax.set_ylabel(label)
+            ax.legend(loc='best', fontsize='small')
+            ax.grid()
+        fig.tight_layout()
+        fig.savefig(figures_dir / "network" / f"{file_prefix}_network.png")
+        plt.close(fig)
+
+
+def draw_graphs(keep_generator_bound=False, fixed_warmup=False, jobs=None):
     results_dir = Path(__file__).parents[1] / "results"
     df = pd.read_pickle(results_dir / "processed_data" / "processed_data.pkl")
 
-    throughput_dir = results_dir / "figures" / "throughput"
-    throughput_dir.mkdir(exist_ok=True)
-    os.chmod(throughput_dir, 0o777)
-    tail_latencies_dir = results_dir / "figures" / "tail_latencies"
-    tail_latencies_dir.mkdir(exist_ok=True)
-    os.chmod(tail_latencies_dir, 0o777)
-
-    # Draw graphs
-    for w_name in df.index.unique():
-        df_w = df.loc[w_name]
-
-        # Throughput
-        plt.plot('number of connections', 'throughput (req/s)', 's-', data=df_w[df_w['type'] == 'native'], label='Native', color=NATIVE_COLOR)
-        plt.plot('number of connections', 'throughput (req/s)', 's-', data=df_w[df_w['type'] == 'wasm'], label='Wasm', color=WASM_COLOR)
-        plt.xlabel('Number of Connections')
-        plt.ylabel('Throughput (req/s)')
-        plt.legend(loc='best')
-        plt.grid()
-        plt.savefig(throughput_dir / f"{'_'.join(w_name.split(' '))}_throughput.png")
-        plt.close()
-
-        # Tail latencies
-        lw = 1.2
-        ms = 7
-        for p,m in [('95', 's'), ('99', '^')]:#, ('99.9', 'o')]:
-            plt.plot('number of connections', f'tail latency {p}% (s)', f'{m}-', data=df_w[df_w['type'] == 'native'], label=f'Native {p}%', color=NATIVE_COLOR, markerfacecolor='none', linewidth=lw, markersize=ms)
-
-        for p,m in [('95', 's'), ('99', '^')]:#, ('99.9', 'o')]:
-            plt.plot('number of connections', f'tail latency {p}% (s)', f'{m}-', data=df_w[df_w['type'] == 'wasm'], label=f'Wasm {p}%', color=WASM_COLOR, markerfacecolor='none', linewidth=lw, markersize=ms)
-
-        plt.xlabel('Number of Connections')
-        plt.ylabel('Tail Latency (s)')
-        plt.legend(loc='best')
-        plt.savefig(tail_latencies_dir / f"{'_'.join(w_name.split(' '))}_tail_latencies.png")
-        plt.close()
+    if not fixed_warmup:
+        df = steady_state_results(df)
+
+    # Runs limited by the load generator itself do not measure the server
+    if not keep_generator_bound and df['generator bound'].any():
+        print(f"Leaving out {df['generator bound'].sum()} generator bound runs (see the 'generator bound' column of the processed data).")
+        df = df[~df['generator bound'].astype(bool)]
+
+    # Runs whose connections were dropped by a full accept queue measure the network stack as much as the server
+    dropped = (df['listen overflows'].fillna(0) > 0) | (df['listen drops'].fillna(0) > 0)
+    if dropped.any():
+        print(f"{dropped.sum()} runs had accept queue overflows, their latencies include SYN retransmits (see the 'listen overflows' and 'listen drops' columns of the processed data, and figures/network).")
+
+    if df.empty:
+        print("No runs left to plot (see --keep-generator-bound).")
+        return
+
+    # Trials of the same run point are plotted as their mean, with a confidence band
+    df = aggregate_trials(df)
+
+    figures_dir = results_dir / "figures"
+    for name in FIGURE_DIRS:
+        (figures_dir / name).mkdir(exist_ok=True)
+        os.chmod(figures_dir / name, 0o777)
+
+    # Figures are independent, so they are drawn in parallel by a pool of processes. Time series and distributions of
+    # generator bound runs are left out as well
+    timeseries = {}
+    for ts in pd.read_pickle(results_dir / "processed_data" / "timeseries.pkl"):
+        if keep_generator_bound or not ts['generator bound']:
+            timeseries.setdefault((ts['workload'], ts['series']), []).append(ts)
+    distributions = [d for d in pd.read_pickle(results_dir / "processed_data" / "distributions.pkl") if keep_generator_bound or not d['generator bound']]
+    with ProcessPoolExecutor(jobs) as pool:
+        futures = [pool.submit(draw_workload, w_name, df.loc[[w_name]], figures_dir) for w_name in df.index.unique()]
+        futures += [pool.submit(draw_timeseries, w_name, s, runs, figures_dir / "timeseries") for (w_name, s), runs in timeseries.items()]
+        futures += [pool.submit(draw_distribution, *job) for job in distribution_jobs(distributions, figures_dir / "distributions", fixed_warmup)]
+        for future in futures:
+            future.result()
 
 
 if __name__ == "__main__":
-    gather_results()
-    draw_graphs()
\ No newline at end of file
+    # Parse arguments
+    parser = argparse.ArgumentParser()
+
+    # Sessions
+    parser.add_argument(
+        '-l', '--label', 
+        type=str, 
+        nargs='+',
+        required=False, 
+        help="Labels of the sessions to analyse (folders in results/raw_data). Defaults to the latest session.",
+        dest="labels"
+    )
+
+    # Generator bound runs
+    parser.add_argument(
+        '--keep-generator-bound', 
+        action='store_true',
+        help="Also plot runs flagged as generator bound (load generator CPU or event loop lag above threshold), which are left out by default.",
+        dest="keep_generator_bound"
+    )
+
+    # Fixed warmup
+    parser.add_argument(
+        '--fixed-warmup',
+        action='store_true',
+        help="Plot the results measured after the fixed warmup share of every run, instead of over its detected steady state.",
+        dest="fixed_warmup"
+    )
+
+    # Compare mode
+    parser.add_argument(
+        '--compare', 
+        type=str, 
+        nargs=2,
+        required=False, 
+        metavar=("BASE", "NEW"),
+        help="Compare two sessions instead of plotting: run points of NEW whose throughput or p99 latency got significantly worse than in BASE are flagged, and the exit code is 1 if there is any. Needs 2 or more trials per point (main.py --repeat). The comparison is stored in processed_data/comparison.csv.",
+        dest="compare"
+    )
+
+    # Regression threshold
+    parser.add_argument(
+        '--threshold', 
+        type=float, 
+        default=REGRESSION_THRESHOLD,
+        help=f"Relative change that the whole confidence interval of a regression must exceed (only used with --compare). Default is {REGRESSION_THRESHOLD}.",
+        dest="threshold"
+    )
+
+    # Figure processes
+    parser.add_argument(
+        '-j', '--jobs', 
+        type=int, 
+        required=False, 
+        help="Number of processes drawing the figures. Defaults to the number of cores.",
+        dest="jobs"
+    )
+
+    args = parser.parse_args()
+
+    if args.compare:
+        gather_results(args.compare)
+        sys.exit(1 if compare(*args.compare, args.threshold, args.fixed_warmup) else 0)
+
+    gather_results(args.labels)
+    draw_graphs(args.keep_generator_bound, args.fixed_warmup, args.jobs)
\ No newline at end of file
@@ -1,118 +1,508 @@
 import argparse
 import asyncio
+import agent
+import gc
+import limits
+import live
 import main
 import multiprocessing
+import netstat
+import numpy as np
 import os
-import pickle
-import resource
-from clients import get_client_method
-from heapq import merge
+import profiles
+import queue
+import storage
+import telemetry
+import time
+import traces
+from clients import ARRIVALS, get_client_method
+from histogram import Histogram, Timeline, bucket_index
+from math import ceil
+from multiprocessing.shared_memory import SharedMemory
 from pathlib import Path
 
 
 WARMUP_PROP = 0.2
-BATCH_SIZE = 250
+CONNS_PER_LOOP = 250
+RAMP = 25000 # Connections opened per second
+RAMP_TICK = 0.01 # s
+GENERATOR_CPU_THRESHOLD = 0.9 # Worker CPU utilization above which the load generator is considered the bottleneck
+LAG_THRESHOLD = 0.005 # s, p99 event loop lag of a worker above which the load generator is considered the bottleneck
+LAG_INTERVAL_NS = 10_000_000 # Event loop lag sampling period
+TASKS_EVERY = 10 # Count pending tasks every TASKS_EVERY lag samples
+DEFAULT_INTERVAL = 1.0
+RAW_CAPACITY = 1 << 20 # Raw samples kept per worker process (16 B each)
+RESULT_POLL = 1.0 # s between checks that the workers are alive while waiting for their results
+PHASES = ('connect', 'ttfb') # Latencies of the connections themselves: connect and time to first byte (see clients.churn_client)
 
 
-async def group(group_id, client_method, warmup_d, duration, connections, host, port, debug, results_q):
+class Recorder:
+    # Latencies of all the connections of a worker process. Everything is preallocated, so that recording
+    # a request does not allocate. The timeline covers the whole run from start_ns, warmup included (so that the
+    # steady state can be found from the data), the histogram and raw samples only the measurement phase.
+    # Raw samples go to a ring buffer of (start, latency) pairs in shared memory (raw = (shared memory name,
+    # capacity)), which the parent maps once the worker is done. With capture, every request sent is also kept
+    # (time from start_ns, connection, payload) to be written as a trace. With live_counters = (shared memory name, row),
+    # completed and offered requests, errors and latencies are also counted for the live metrics (see live.py).
+    # Connect latencies and times to first byte get their own histograms (phases), also for the measurement phase only
+    def __init__(self, start_ns, warmup, duration, interval, raw, capture=False, live_counters=None):
+        self.start_ns = start_ns
+        self.live_shm, self.live = live.attach(*live_counters) if live_counters is not None else (None, None)
+        self.trace = [] if capture else None
+        self.warmup_end_ns = start_ns + int(warmup * 1e9)
+        self.histogram = Histogram()
+        self.phases = {name: Histogram() for name in PHASES}
+        self.timeline = Timeline(start_ns, int(interval * 1e9), ceil((warmup + duration) / interval) + 1) if interval else None
+        self.shm = None
+        self.samples = None
+        self.capacity = 0
+        self.n_samples = 0
+        if raw is not None:
+            self.shm = SharedMemory(name=raw[0])
+            self.samples = self.shm.buf.cast('q')
+            self.capacity = raw[1]
+
+    def record(self, start, duration):
+        if self.live is not None:
+            self.live[live.COMPLETED] += 1
+            self.live[live.HEADER + bucket_index(duration)] += 1
+        if self.timeline is not None:
+            self.timeline.record(start, duration)
+        if start < self.warmup_end_ns:
+            return
+        self.histogram.record(duration)
+        if self.samples is not None:
+            i = (self.n_samples % self.capacity) << 1
+            self.samples[i] = start
+            self.samples[i + 1] = duration
+            self.n_samples += 1
+
+    def phase(self, name, start, duration):
+        if start >= self.warmup_end_ns:
+            self.phases[name].record(duration)
+
+    def offer(self, start):
+        # A request due to be sent (intended send time), whether or not it completes
+        if self.live is not None:
+            self.live[live.OFFERED] += 1
+        if self.timeline is not None:
+            self.timeline.offer(start)
+
+    def error(self, abort=False):
+        if self.live is not None:
+            self.live[live.ABORTS if abort else live.RECONNECTS] += 1
+
+    def capture(self, id, start, payload):
+        if self.trace is not None:
+            self.trace.append((start - self.start_ns, id, payload))
+
+    def close(self):
+        if self.shm is not None:
+            self.samples.release()
+            self.shm.close()
+        if self.live_shm is not None:
+            self.live.release()
+            self.live_shm.close()
+
+
+async def monitor(warmup_end, deadline):
+    # Load generator overhead of this worker over the measurement phase: event loop lag (how late a periodic timer
+    # wakes up, i.e. how long ready callbacks wait to run), pending tasks and CPU utilization. A large lag or a CPU
+    # utilization close to 1 mean that the event loop, not the server, limits the load and inflates the latencies
+    loop = asyncio.get_running_loop()
+    lag = Histogram()
+    tasks_max = tasks_sum = tasks_n = 0
+    await asyncio.sleep(max(warmup_end - loop.time(), 0))
+    cpu_start, wall_start = time.process_time(), time.perf_counter()
+    i = 0
+    while loop.time() < deadline:
+        scheduled = time.perf_counter_ns() + LAG_INTERVAL_NS
+        await asyncio.sleep(LAG_INTERVAL_NS * 1e-9)
+        lag.record(time.perf_counter_ns() - scheduled)
+        i += 1
+        if i % TASKS_EVERY == 0:
+            n = len(asyncio.all_tasks(loop))
+            tasks_max = max(tasks_max, n)
+            tasks_sum += n
+            tasks_n += 1
+    return {
+        'cpu': (time.process_time() - cpu_start) / (time.perf_counter() - wall_start),
+        'lag': lag,
+        'tasks_max': tasks_max,
+        'tasks_mean': tasks_sum / tasks_n if tasks_n else 0,
+    }
+
+
+async def group(worker_id, first_id, connections, config, results_q):
+    # Wait for the common start of all the workers (and agents), given as wall clock time
+    if config['start_at'] is not None:
+        await asyncio.sleep(max(config['start_at'] - time.time(), 0))
+
     # Run benchmark
     tasks = []
-    remaining = connections
+    loop = asyncio.get_running_loop()
+    client_method = get_client_method(config['workload'], config['churn'] is not None) # Choose adequate client method for benchmark
     async with asyncio.TaskGroup() as tg:
-        start_time = asyncio.get_running_loop().time()
-        warmup_end = start_time + warmup_d
-        deadline = warmup_end + duration
-        while remaining > 0:
-            for j in range(min(BATCH_SIZE, remaining)):
+        start_time = loop.time()
+        warmup_end = start_time + config['warmup']
+        deadline = warmup_end + config['duration']
+        recorder = Recorder(time.perf_counter_ns(), config['warmup'], config['duration'], config['interval'], config['raw'], config['capture'] is not None, (config['live'], worker_id) if config['live'] else None)
+        monitor_task = tg.create_task(monitor(warmup_end, deadline))
+        profile = None
+        if config['profile'] is not None:
+            profile = profiles.profile_at(config['profile'], recorder.start_ns, config['warmup'] + config['duration'])
+        replays = {}
+        if config['trace'] is not None:
+            replays = traces.connection_traces(config['trace'], config['connections'], range(first_id, first_id + connections), recorder.start_ns, config['speed'])
+
+        # Open connections at the ramp rate (connections/s of this worker), a few every RAMP_TICK
+        opened = 0
+        while opened < connections:
+            target = min(connections, max(opened + 1, int((loop.time() - start_time) * config['ramp'])))
+            for id in range(first_id + opened, first_id + target):
+                # Churn: every connection is a slot of short-lived sessions instead of a long-lived connection
+                if config['churn'] is not None:
+                    options = {'rate': config['connection_rate'], 'requests': config['churn']}
+                else:
+                    options = {'rate': config['rate'], 'window': config['window'], 'profile': profile, 'trace': replays.get(id)}
+                # Spread the connections evenly over every (source address, destination port) pair
+                sources, ports = config['sources'] or [None], config['ports']
                 tasks.append(tg.create_task(client_method(
-                    id=group_id + connections - remaining + j, 
-                    host=host, 
-                    port=port, 
-                    warmup_end=warmup_end, 
+                    id=id, 
+                    host=config['host'], 
+                    port=ports[id // len(sources) % len(ports)], 
                     deadline=deadline,
-                    debug=debug
+                    recorder=recorder,
+                    arrival=config['arrival'],
+                    source=sources[id % len(sources)],
+                    linger=config['linger'],
+                    seed=config['seed'],
+                    debug=config['debug'],
+                    **options
                 )))
-            await asyncio.sleep(0.01) # Small delay between batch creation to not overload the server
-            remaining -= BATCH_SIZE
+            opened = target
+            await asyncio.sleep(RAMP_TICK)
 
-    
-    latencies = list(merge(*[task.result()[0] for task in tasks]))
-    error_abort = any([task.result()[1] for task in tasks])
-    error_reconnect = any([task.result()[2] for task in tasks])
-    results_q.put((latencies, error_abort, error_reconnect))
+    # Only the compact summaries are sent back to the parent (raw samples stay in shared memory, captured
+    # requests go to a trace file)
+    recorder.close()
+    if recorder.trace is not None:
+        traces.write_trace(traces.part_path(config['capture'], worker_id), recorder.trace)
+    error_abort = any([task.result()[0] for task in tasks])
+    error_reconnect = any([task.result()[1] for task in tasks])
+    results_q.put((worker_id, recorder.histogram, recorder.timeline, recorder.n_samples, monitor_task.result(), error_abort, error_reconnect, recorder.phases))
 
-def group_runner(group_id, client_method, warmup_d, duration, connections, host, port, debug, results_q):
-    asyncio.run(group(group_id, client_method, warmup_d, duration, connections, host, port, debug, results_q))
+def run_key(workload, series, runtime_config, connections, rate, arrival, duration, window=1, trial=0, profile=None, trace=None, speed=1.0, churn=None, connection_rate=None):
+    # Identifies a run point (and trial of it) in the manifest of a session
+    key = f"{workload}|{series}|{runtime_config or ''}|c{connections}|r{rate if rate is not None else '-'}{arrival if rate is not None else ''}|d{duration}"
+    if window > 1:
+        key += f"|w{window}"
+    if profile is not None:
+        key += f"|p{profile}"
+    if trace is not None:
+        key += f"|trace{trace}x{speed:g}"
+    if churn is not None:
+        key += f"|churn{churn}r{connection_rate if connection_rate is not None else '-'}{arrival if connection_rate is not None else ''}"
+    if trial > 0:
+        key += f"|t{trial}"
+    return key
 
-async def bench(workload, wasm, duration, connections, host, port, debug=False):
-    # Set warmup time
-    warmup_d = WARMUP_PROP * duration
+def parse_ranges(ranges):
+    # CPU or port list such as '0-3,6' -> [0, 1, 2, 3, 6]
+    result = []
+    for part in ranges.split(','):
+        first, _, last = part.partition('-')
+        result.extend(range(int(first), int(last or first) + 1))
+    return result
+
+def group_runner(worker_id, first_id, connections, config, results_q):
+    # Pin the worker to its own core
+    if config['cpus']:
+        os.sched_setaffinity(0, {config['cpus'][worker_id % len(config['cpus'])]})
+    # Keep the garbage collector out of the measured latencies: everything allocated so far is frozen and
+    # collections are disabled for the (short) lifetime of the worker
+    gc.freeze()
+    gc.disable()
+    asyncio.run(group(worker_id, first_id, connections, config, results_q))
 
-    # Choose adequate client method for benchmark
-    client_method = get_client_method(workload)
+def n_workers(connections, processes=None, conns_per_loop=CONNS_PER_LOOP, cpus=None):
+    # Worker topology: number of processes (one event loop each), by default enough for conns_per_loop connections
+    # per loop without exceeding the available cores
+    n_cpu = len(cpus) if cpus else os.cpu_count()
+    n_processes = processes or max(1, min(n_cpu, ceil(connections / conns_per_loop)))
+    return min(n_processes, connections)
 
-    # Balance load
-    n_cpu = os.cpu_count()
-    n_processes = max(1, min(n_cpu, connections // BATCH_SIZE))
+def start_workers(config, connections, n_processes, first_id=0, raw_capacity=None):
+    # Start the worker processes, each with its share of the connections (config['ramp'] is split among them too).
+    # Returns the processes, the ring buffers of their raw samples (if raw_capacity) and the queue of their results
     div_ = connections // n_processes
     rem_ = connections % n_processes
     # connections = rem_ * (div_ + 1) + (n_processes - rem_) * div_ (Most balanced distribution)
+    config = dict(config, ramp=config['ramp'] / n_processes)
 
-    processes = []
+    workers = []
+    buffers = {}
     results_q = multiprocessing.Queue()
-    group_id = 0
-    for i in range(n_processes):
-        if i < rem_:
+    for worker_id in range(n_processes):
+        if worker_id < rem_:
             group_connections = div_ + 1
         else:
             group_connections = div_
 
+        # Ring buffer for raw samples
+        worker_config = config
+        if raw_capacity:
+            buffers[worker_id] = SharedMemory(create=True, size=16 * raw_capacity)
+            worker_config = dict(config, raw=(buffers[worker_id].name, raw_capacity))
+
         process = multiprocessing.Process(
             target=group_runner, 
-            args=(group_id, client_method, warmup_d, duration, group_connections, host, port, debug, results_q)
+            args=(worker_id, first_id, group_connections, worker_config, results_q)
         )
-        processes.append(process)
+        workers.append(process)
         process.start()
-        group_id += group_connections
+        first_id += group_connections # Connections get consecutive ids across workers
+    return workers, buffers, results_q
+
+def gather_workers(workers, results_q):
+    # Results of every worker, by worker id. A worker that dies (crash, OOM kill) never sends its result, so the
+    # workers are checked every RESULT_POLL s while waiting, and the others are stopped if one of them died
+    results = []
+    try:
+        while len(results) < len(workers):
+            # Workers that exited before the wait have flushed their result to the queue already (if they sent one)
+            exited = {worker_id for worker_id, process in enumerate(workers) if process.exitcode is not None}
+            try:
+                results.append(results_q.get(timeout=RESULT_POLL))
+            except queue.Empty:
+                missing = sorted(exited - {result[0] for result in results})
+                if missing:
+                    dead = ', '.join(f"worker {worker_id} (exit code {workers[worker_id].exitcode})" for worker_id in missing)
+                    raise RuntimeError(f"Load generator workers exited without sending their results: {dead}.")
+    finally:
+        for process in workers:
+            if len(results) < len(workers):
+                process.terminate()
+            process.join()
+    return sorted(results, key=lambda result: result[0])
+
+async def bench(workload, wasm, duration, connections, host, port, rate=None, arrival='poisson', interval=DEFAULT_INTERVAL, raw=False, raw_capacity=RAW_CAPACITY, server_pid=None, cold_start=None, label=storage.DEFAULT_LABEL, runtime_config=None, series=None, window=1, trial=0, profile=None, trace=None, speed=1.0, churn=None, connection_rate=None, seed=None, capture=None, live_view=False, metrics=None, sources=None, ports=None, linger=None, agents=None, processes=None, conns_per_loop=CONNS_PER_LOOP, ramp=RAMP, cpus=None, lag_threshold=LAG_THRESHOLD, debug=False):
+    # Set warmup time
+    warmup_d = WARMUP_PROP * duration
 
-    # Gather results
+    # Runtime configuration the results belong to (plain native and wasm by default)
+    series = series or ('wasm' if wasm else 'native')
+
+    ports = ports or [int(port)]
+    if agents and raw:
+        raise ValueError("Raw samples are not supported with agents, which only send back summaries.")
+    if agents and capture:
+        raise ValueError("Capturing a trace is not supported with agents, which only send back summaries.")
+    if agents and (live_view or metrics):
+        print("Warning: live metrics are not available with agents, which only send back summaries at the end of the run.")
+    if trace is not None and (rate is not None or profile is not None):
+        raise ValueError("A replayed trace has its own schedule, it cannot be combined with a rate or a profile.")
+    if churn is not None and churn < 1:
+        raise ValueError("Churn runs send at least 1 request per connection.")
+    if churn is not None and (rate is not None or window > 1 or profile is not None or trace is not None or capture is not None):
+        raise ValueError("Churn runs send their requests over short-lived connections at the connection rate, they cannot be combined with a request rate, a window, a profile, a trace or a capture.")
+    if connection_rate is not None and churn is None:
+        raise ValueError("A connection rate is only used with churn.")
+
+    # Settings shared by all workers (plain data, so that they can also be sent to agents)
+    get_client_method(workload) # Fail early for workloads without a client
+    config = {
+        'workload': workload,
+        'host': host,
+        'sources': sources, # Local source addresses
+        'ports': ports, # Destination ports
+        'linger': linger,
+        'warmup': warmup_d,
+        'duration': duration,
+        'rate': rate / connections if rate is not None else None, # Open loop: the offered load is split evenly across the connection pool
+        'arrival': arrival,
+        'window': window, # Requests in flight per connection
+        'profile': profile, # Load over time (see profiles.py)
+        'trace': str(trace) if trace is not None else None, # Replayed trace (open loop, see traces.py)
+        'speed': speed, # Replay speed
+        'connections': connections, # All the connections of the run, the trace is spread over them
+        'churn': churn, # Most requests per connection of churn runs (short-lived connections)
+        'connection_rate': connection_rate / connections if connection_rate is not None else None, # Churn: sessions/s of every connection slot
+        'seed': seed, # Seed of the request generators (random if None)
+        'capture': str(capture) if capture is not None else None, # Trace file the requests sent are written to
+        'live': None, # Shared memory block of the live counters
+        'interval': interval,
+        'ramp': ramp, # Connections opened per second (split among workers)
+        'cpus': cpus,
+        'raw': None,
+        'start_at': None, # Wall clock time at which the workers start (agents)
+        'debug': debug,
+    }
+
+    if not agents:
+        # Check that the connections fit in the ports and file descriptors of this host (raising the limit if needed)
+        limits.preflight(connections, host, sources, ports)
+
+    # Sample the resource usage of the server while the benchmark runs
+    sampler = None
+    if server_pid is not None:
+        sampler = telemetry.Sampler(server_pid)
+        sampler.start()
+
+    # Network stack counters and socket states of the benchmarked ports (accept queue overflows, retransmits, resets)
+    network = netstat.Snapshots(ports, warmup_d + duration / 2)
+
+    buffers = {}
+    counters = None
+    monitor = None
+    try:
+        if agents:
+            # Distributed: the agents run the workers, synchronized on a common start, and send back their results
+            results = await agent.run_agents(agents, config, connections, processes, conns_per_loop)
+        else:
+            n_processes = n_workers(connections, processes, conns_per_loop, cpus)
+            if live_view or metrics:
+                # Live metrics of the workers, aggregated by a thread while they run
+                counters = live.create(n_processes)
+                config['live'] = counters.name
+                monitor = live.Monitor(counters, n_processes, warmup_d, {'workload': workload, 'series': series, 'connections': connections, 'rate': rate}, live_view, metrics)
+            workers, buffers, results_q = start_workers(config, connections, n_processes, raw_capacity=raw_capacity if raw else None)
+            if monitor is not None:
+                monitor.start()
+            results = gather_workers(workers, results_q)
+    finally:
+        # Also when the run failed, so that no thread outlives it
+        if monitor is not None and monitor.is_alive():
+            monitor.stop()
+        if counters is not None:
+            counters.close()
+            counters.unlink()
+        server_telemetry = sampler.stop() if sampler is not None else None
+        network = network.stop()
+    n_processes = len(results)
+    if capture is not None:
+        print(f"Captured {traces.merge_parts(capture, n_processes)} requests to {capture}")
+
+    # Merge results
     error_abort = False
     error_reconnect = False
-    ls = []
-    for _ in processes:
-        r = results_q.get()
-        ls.append(r[0])
-        if r[1]: error_abort = True
-        if r[2]: error_reconnect = True
+    histogram = Histogram()
+    timeline = None
+    n_samples = {}
+    worker_cpu = [0.0] * n_processes
+    worker_lag = [0.0] * n_processes
+    worker_tasks = [0] * n_processes
+    lag = Histogram()
+    phases = {name: Histogram() for name in PHASES}
+    for worker_id, h, t, n, overhead, e_abort, e_reconnect, worker_phases in results:
+        histogram.merge(h)
+        for name, phase in worker_phases.items():
+            phases[name].merge(phase)
+        if t is not None:
+            timeline = t if timeline is None else timeline.merge(t)
+        n_samples[worker_id] = n
+        worker_cpu[worker_id] = overhead['cpu']
+        worker_lag[worker_id] = overhead['lag'].percentile(99) * 1e-9
+        worker_tasks[worker_id] = overhead['tasks_max']
+        lag.merge(overhead['lag'])
+        if e_abort: error_abort = True
+        if e_reconnect: error_reconnect = True
 
-    # Join processes
-    for process in processes:
-        process.join()
+    # A worker that used (almost) a whole core or whose event loop lagged behind was limiting the load itself
+    generator_bound = max(worker_cpu) >= GENERATOR_CPU_THRESHOLD or max(worker_lag) >= lag_threshold
+    if generator_bound:
+        print(f"Warning: load generator bound ({workload}, {connections} connections), a worker process used {max(worker_cpu):.0%} of a core with a p99 event loop lag of {max(worker_lag) * 1e3:.2f} ms. Use more processes (--processes) or fewer connections per loop.")
+    if network['counters']['listen overflows'] or network['counters']['listen drops']:
+        print(f"Warning: the accept queue overflowed ({workload}, {connections} connections), {network['counters']['listen overflows']} listen overflows and {network['counters']['listen drops']} listen drops during the run. Connections were delayed by SYN retransmits, a lower --ramp may help.")
 
     # Finish processing results
-    latencies = list(merge(*ls))
-    m = min([p[0] for p in latencies] + [float('inf')])
-    results = {
+    meta = {
+        'workload': workload,
         'type': 'wasm' if wasm else 'native',
+        'series': series,
         'duration': duration,
+        'warmup': warmup_d,
         'connections': connections,
+        'rate': rate,
+        'arrival': arrival if rate is not None or connection_rate is not None else None,
+        'window': window,
+        'trial': trial, # Repetition of the same run point
+        'profile': profile,
+        'trace': Path(trace).name if trace is not None else None,
+        'speed': speed if trace is not None else None,
+        'churn': churn,
+        'connection_rate': connection_rate,
+        'seed': seed,
+        'sources': sources,
+        'ports': ports,
+        'agents': agents,
         'error_abort': error_abort,
         'error_reconnect': error_reconnect,
-        'latencies': [(t-m, l) for (t, l) in latencies]
+        'histogram': histogram.state(),
+        'phases': {name: phase.state() for name, phase in phases.items() if phase.total}, # Histograms in the <name>_histogram columns
+        'timeline_interval': interval if timeline is not None else None,
+        'timeline_start': -warmup_d, # s, relative to the end of the warmup (the timeline starts with the run)
+        'cold_start': cold_start,
+        'runtime_config': runtime_config,
+        'processes': n_processes,
+        'worker_cpu': worker_cpu,
+        'worker_lag_p99': worker_lag,
+        'worker_tasks_max': worker_tasks,
+        'loop_lag': {'p50': lag.percentile(50) * 1e-9, 'p99': lag.percentile(99) * 1e-9, 'max': lag.max * 1e-9} if lag.total else None,
+        'generator_bound': generator_bound,
+        'network': network, # Counter changes over the run (host wide) and socket states of the benchmarked ports
     }
-    
-    # Select name of output file
-    output_file = f"{workload}_{'wasm' if wasm else 'native'}_d{duration}_c{connections}"
+    columns = {'histogram': np.frombuffer(histogram.counts, dtype=np.int64)}
+    for name, phase in phases.items():
+        if phase.total:
+            columns[f'{name}_histogram'] = np.frombuffer(phase.counts, dtype=np.int64)
+    if timeline is not None:
+        columns['timeline'] = timeline.columns()
+        columns['interval_histograms_sparse'] = timeline.histogram_entries() # Nonzero buckets only
+    if server_telemetry is not None:
+        columns['telemetry'] = server_telemetry
+    if raw:
+        # Map the ring buffers of all workers, then sort by start time and normalize it in one go
+        ls = []
+        dropped = 0
+        for g_id, shm in buffers.items():
+            n = n_samples.get(g_id, 0)
+            ls.append(np.ndarray((raw_capacity, 2), dtype=np.int64, buffer=shm.buf)[:min(n, raw_capacity)].copy())
+            dropped += max(n - raw_capacity, 0)
+            shm.close()
+            shm.unlink()
+        latencies = np.concatenate(ls)
+        latencies = latencies[np.argsort(latencies[:, 0], kind='stable')]
+        if len(latencies):
+            latencies[:, 0] -= latencies[0, 0]
+        columns['latencies'] = latencies
+        meta['raw_dropped'] = dropped # Oldest samples overwritten when a ring buffer wrapped around
+
+    # Select name of output folder
+    output_dir = f"{workload}_{series}_d{duration}_c{connections}"
+    if rate is not None:
+        output_dir += f"_r{rate:g}_{arrival}"
+    if window > 1:
+        output_dir += f"_w{window}"
+    if profile is not None:
+        output_dir += f"_p{profiles.file_name(profile)}"
+    if trace is not None:
+        output_dir += f"_trace-{Path(trace).stem}_x{speed:g}"
+    if churn is not None:
+        output_dir += f"_churn{churn}" + (f"_cr{connection_rate:g}_{arrival}" if connection_rate is not None else "")
+    if trial > 0:
+        output_dir += f"_t{trial}"
 
-    # Store results
-    folder = Path(__file__).parents[1] / "results" / "raw_data" /main.WORKLOADS[workload]
-    folder.mkdir(exist_ok=True)
+    # Store results, then mark the run point as completed in the manifest of the session
+    session_dir = storage.RAW_DATA_DIR / label
+    folder = session_dir / main.WORKLOADS[workload]
+    folder.mkdir(parents=True, exist_ok=True)
+    os.chmod(session_dir, 0o777)
     os.chmod(folder, 0o777)
-    file = open(folder / f"{output_file}.pkl", 'wb')
-    pickle.dump(results, file)
-    file.close()
+    storage.save_run(folder / output_dir, meta, columns)
+    storage.record_run(session_dir, run_key(workload, series, runtime_config, connections, rate, arrival, duration, window, trial, profile, Path(trace).name if trace is not None else None, speed, churn, connection_rate), folder / output_dir)
 
-    return error_abort
+    return meta, histogram
 
 
 if __name__ == "__main__":
@@ -157,6 +547,105 @@ if __name__ == "__main__":
         dest="workload"
     )
 
+    # Rate
+    parser.add_argument(
+        '-r', '--rate', 
+        type=float, 
+        required=False, 
+        help="Total offered load in requests per second. If set, requests are issued open-loop on a fixed schedule spread across all connections and latency is measured from each request's intended send time. If not set, every connection runs closed-loop (send, wait for the response, think).",
+        dest="rate"
+    )
+
+    # Arrival process
+    parser.add_argument(
+        '-a', '--arrival', 
+        type=str, 
+        choices=ARRIVALS,
+        default='poisson', 
+        help="Arrival process of the open-loop schedule (only used with --rate, or with --connection-rate for the connections of a churn run).",
+        dest="arrival"
+    )
+
+    # Timeline interval
+    parser.add_argument(
+        '-i', '--interval', 
+        type=float, 
+        default=DEFAULT_INTERVAL,
+        help=f"Width in seconds of the time buckets in which requests and latencies are also counted (0 disables them). Default is {DEFAULT_INTERVAL}.",
+        dest="interval"
+    )
+
+    # Raw samples
+    parser.add_argument(
+        '--raw', 
+        action='store_true',
+        help="Also store every (start, latency) sample. Only latency histograms are stored otherwise.",
+        dest="raw"
+    )
+
+    # Raw samples capacity
+    parser.add_argument(
+        '--raw-capacity', 
+        type=int, 
+        default=RAW_CAPACITY,
+        help=f"Number of raw samples kept by each worker process (only used with --raw). When exceeded, the oldest samples are overwritten. Default is {RAW_CAPACITY}.",
+        dest="raw_capacity"
+    )
+
+    # Series
+    parser.add_argument(
+        '-s', '--series', 
+        type=str, 
+        required=False, 
+        help="Name of the runtime configuration being benchmarked (e.g. wasm-aot), under which its results are stored and plotted. Defaults to 'wasm' or 'native' (see --wasm).",
+        dest="series"
+    )
+
+    # Pipelining window
+    parser.add_argument(
+        '--window', 
+        type=int, 
+        default=1,
+        help="Requests in flight per connection. Above 1, each connection pipelines requests without waiting for the previous responses, which are matched in order. Default is 1.",
+        dest="window"
+    )
+
+    # Source addresses
+    parser.add_argument(
+        '--sources', 
+        type=limits.parse_sources, 
+        required=False, 
+        help=f"Local addresses and networks to open the connections from, e.g. '127.0.0.2,127.0.1.0/24' (at most {limits.MAX_NETWORK_SOURCES} addresses per network). Each one adds a whole ephemeral port range, so that more connections fit than from a single address.",
+        dest="sources"
+    )
+
+    # Destination ports
+    parser.add_argument(
+        '--ports', 
+        type=parse_ranges, 
+        required=False, 
+        help="Ports the connections are spread over, e.g. '1234-1237', if the server listens on several. Defaults to the port of --host.",
+        dest="ports"
+    )
+
+    # Linger
+    parser.add_argument(
+        '--linger', 
+        type=int, 
+        required=False, 
+        help="SO_LINGER timeout in seconds of the client sockets. 0 resets connections on close, which leaves no TIME_WAIT sockets behind. Default is the system behaviour.",
+        dest="linger"
+    )
+
+    # Server process
+    parser.add_argument(
+        '-p', '--pid', 
+        type=int, 
+        required=False, 
+        help=f"PID of the server process. If set, its resource usage (CPU time, RSS/PSS, threads, context switches, open fds) is sampled every {telemetry.TELEMETRY_INTERVAL} s and stored with the results.",
+        dest="pid"
+    )
+
     # Wasm
     parser.add_argument(
         '-W', '--wasm', 
@@ -165,6 +654,160 @@ if __name__ == "__main__":
         dest="wasm"
     )
 
+    # Worker processes
+    parser.add_argument(
+        '--processes', 
+        type=int, 
+        required=False, 
+        help=f"Number of load generator processes (one event loop each). By default, one per {CONNS_PER_LOOP} connections (see --conns-per-loop) up to the number of available cores.",
+        dest="processes"
+    )
+
+    # Connections per event loop
+    parser.add_argument(
+        '--conns-per-loop', 
+        type=int, 
+        default=CONNS_PER_LOOP,
+        help=f"Connections per event loop used to choose the number of processes when --processes is not set. Default is {CONNS_PER_LOOP}.",
+        dest="conns_per_loop"
+    )
+
+    # Ramp rate
+    parser.add_argument(
+        '--ramp', 
+        type=float, 
+        default=RAMP,
+        help=f"Connections opened per second at the start of the benchmark. Default is {RAMP}.",
+        dest="ramp"
+    )
+
+    # Worker CPUs
+    parser.add_argument(
+        '--cpus', 
+        type=parse_ranges, 
+        required=False, 
+        help="CPUs to pin the load generator processes to (one CPU each, round robin), e.g. '0-3,6'. Keep them disjoint from the server's.",
+        dest="cpus"
+    )
+
+    # Event loop lag threshold
+    parser.add_argument(
+        '--lag-threshold', 
+        type=float, 
+        default=LAG_THRESHOLD,
+        help=f"p99 event loop lag in seconds of a load generator process above which the run is flagged as generator bound. Default is {LAG_THRESHOLD}.",
+        dest="lag_threshold"
+    )
+
+    # Agents
+    parser.add_argument(
+        '--agents', 
+        type=str, 
+        nargs='+',
+        required=False, 
+        help=f"Addresses (host[:port], default port {agent.AGENT_PORT}) of agents (agent.py) to generate the load from, instead of local processes. The connections are split evenly among them, they start at the same time and send back latency summaries (no raw samples).",
+        dest="agents"
+    )
+
+    # Load profile
+    parser.add_argument(
+        '--profile', 
+        type=profiles.parse_profile, 
+        required=False, 
+        help="Change the load over the run, as a level between 0 and 1 of the offered load (--rate) or of the connections (closed loop, connections are switched on and off): 'ramp:FROM:TO', 'step:L1,L2,...', 'square:PERIOD:LOW:HIGH' (bursts) or 'spike:AT:LENGTH:BASE' (times in s from the start of the run, warmup included). The offered and achieved load are recorded in the timeline.",
+        dest="profile"
+    )
+
+    # Trace replay
+    parser.add_argument(
+        '--trace', 
+        type=Path, 
+        required=False, 
+        help="Replay a request trace (see traces.py: '<time in s> <connection> <payload in hex>' per line) instead of generating requests. Every request is sent at its time from the start of the run (open loop), the connections of the trace being spread over --connections.",
+        dest="trace"
+    )
+
+    # Replay speed
+    parser.add_argument(
+        '--speed', 
+        type=float, 
+        default=1.0,
+        help="Speed of the replay (only used with --trace), e.g. 2 sends the requests twice as fast. Default is 1.",
+        dest="speed"
+    )
+
+    # Seed
+    parser.add_argument(
+        '--seed', 
+        type=int, 
+        required=False, 
+        help="Seed of the request generators. Every connection gets its own generator seeded from it, so that runs with the same seed send the same requests, with the same gaps between their intended send times. Random by default.",
+        dest="seed"
+    )
+
+    # Trace capture
+    parser.add_argument(
+        '--capture', 
+        type=Path, 
+        required=False, 
+        help="Write every request sent during the run to this trace file, to replay it later with --trace.",
+        dest="capture"
+    )
+
+    # Churn
+    parser.add_argument(
+        '--churn', 
+        type=int, 
+        required=False, 
+        metavar="N",
+        help="Short-lived connections: every connection (slot) repeatedly connects, sends 1 to N requests (at random) one after the other and closes. Besides the request latencies, the connect latency and the time to first byte of every connection are recorded. Closing connections leaves TIME_WAIT sockets, see --linger and --sources.",
+        dest="churn"
+    )
+
+    # Connection arrival rate
+    parser.add_argument(
+        '--connection-rate', 
+        type=float, 
+        required=False, 
+        help="New connections per second of a churn run, spread across the connection slots (open loop, following --arrival). Without it, every slot opens its next connection after a think time.",
+        dest="connection_rate"
+    )
+
+    # Live view
+    parser.add_argument(
+        '--live', 
+        action='store_true',
+        help=f"Show the throughput, latencies and errors of the last {live.LIVE_INTERVAL:g} s while the run goes on (status line on stderr).",
+        dest="live_view"
+    )
+
+    # Live metrics file
+    parser.add_argument(
+        '--metrics', 
+        type=Path, 
+        required=False, 
+        help=f"File the live metrics are written to every {live.LIVE_INTERVAL:g} s while the run goes on: appended as JSON lines, or the latest ones in Prometheus text format if the file name ends with .prom (e.g. for the textfile collector of node_exporter).",
+        dest="metrics"
+    )
+
+    # Trial
+    parser.add_argument(
+        '--trial', 
+        type=int, 
+        default=0,
+        help="Index of this repetition of the run point, so that repeated runs are stored side by side in the session. Default is 0.",
+        dest="trial"
+    )
+
+    # Session
+    parser.add_argument(
+        '-l', '--label', 
+        type=str, 
+        default=storage.DEFAULT_LABEL,
+        help=f"Label of the session the results are stored in (results/raw_data/<label>). Default is '{storage.DEFAULT_LABEL}'.",
+        dest="label"
+    )
+
     # Debug
     parser.add_argument(
         '-d', '--debug', 
@@ -181,9 +824,5 @@ if __name__ == "__main__":
         host += x
     port = aux[-1]
 
-    # Maximum number of file descriptors (sockets in this case) that we can open 
-    max_fd = args.connections + 100
-    resource.setrlimit(resource.RLIMIT_NOFILE, (max_fd, max_fd))
-
     # Run benchmark
-    asyncio.run(bench(args.workload, args.wasm, args.duration, args.connections, host, port, args.debug))
\ No newline at end of file
+    asyncio.run(bench(args.workload, args.wasm, args.duration, args.connections, host, port, args.rate, args.arrival, args.interval, args.raw, args.raw_capacity, args.pid, label=args.label, series=args.series, window=args.window, trial=args.trial, profile=args.profile, trace=args.trace, speed=args.speed, churn=args.churn, connection_rate=args.connection_rate, seed=args.seed, capture=args.capture, live_view=args.live_view, metrics=args.metrics, sources=args.sources, ports=args.ports, linger=args.linger, agents=args.agents, processes=args.processes, conns_per_loop=args.conns_per_loop, ramp=args.ramp, cpus=args.cpus, lag_threshold=args.lag_threshold, debug=args.debug))
\ No newline at end of file
@@ -0,0 +1,43 @@
+import numpy as np
+
+
+# Bootstrap over the trials of a run point (--repeat): the trials are resampled with replacement, all resamples
+# at once as a (SAMPLES, n) index matrix. A fixed seed keeps intervals (and regression verdicts) reproducible
+SAMPLES = 10000
+CONFIDENCE = 0.95
+SEED = 0
+
+
+def resample_means(values, rng):
+    # Means of SAMPLES resamples of values
+    values = np.asarray(values, dtype=float)
+    index = rng.integers(0, len(values), (SAMPLES, len(values)))
+    return values[index].mean(axis=1)
+
+
+def interval(distribution, confidence=CONFIDENCE):
+    # Percentile interval of a bootstrap distribution
+    alpha = (1 - confidence) / 2 * 100
+    lo, hi = np.percentile(distribution, [alpha, 100 - alpha])
+    return lo, hi
+
+
+def confidence_interval(values, confidence=CONFIDENCE):
+    # Confidence interval of the mean of values (one per trial). Undefined with less than 2 trials
+    values = np.asarray(values, dtype=float)
+    values = values[~np.isnan(values)]
+    if len(values) < 2:
+        return np.nan, np.nan
+    return interval(resample_means(values, np.random.default_rng(SEED)), confidence)
+
+
+def relative_change(base, new, confidence=CONFIDENCE):
+    # Relative change of the mean from the base trials to the new ones, and its confidence interval
+    base = np.asarray(base, dtype=float)
+    new = np.asarray(new, dtype=float)
+    change = new.mean() / base.mean() - 1
+    if len(base) < 2 or len(new) < 2:
+        return change, np.nan, np.nan
+    rng = np.random.default_rng(SEED)
+    lo, hi = interval(resample_means(new, rng) / resample_means(base, rng) - 1, confidence)
+    return change, lo, hi
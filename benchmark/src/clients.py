@@ -1,166 +1,396 @@
 import asyncio
+import limits
+import profiles
 import random
+import socket
+import struct
 import time
+from collections import deque, namedtuple
+from functools import partial
 
 MEAN_DELAY = 1.0
+MAX_DELAY = 10.0
+ARRIVALS = ('poisson', 'constant')
+ML_BATCH_SIZE = 20 # Predictions (ints) per response of the machine learning server (BATCH_SIZE in machine_learning.c)
 
 
-async def client_rdb(id, host, port, warmup_end, deadline, debug=False):
-    request_logs = []
+# What a client of a workload sends and expects back:
+# - request: rng -> bytes of the next request
+# - response: exact size in bytes of each response, or an async (reader -> bytes) framing rule for variable sized ones
+# - think_time: rng -> seconds to wait after each response (closed loop)
+WorkloadSpec = namedtuple('WorkloadSpec', ['request', 'response', 'think_time'])
+
+
+def exponential_think_time(rng):
+    return min(rng.expovariate(1 / MEAN_DELAY), MAX_DELAY)
+
+
+# Requests are encoded once, sending one only picks it
+KV_REQUESTS = tuple(f"1{i}".encode() for i in range(10)) # Work index 1, value index 0-9
+ML_REQUESTS = tuple(f"{i:04d}".encode() for i in range(10000)) # Batch index, fixed width so that requests are not split or merged
+
+SPECS = {
+    'rdb': WorkloadSpec(
+        request=lambda rng: KV_REQUESTS[rng.randrange(len(KV_REQUESTS))],
+        response=4, # int result
+        think_time=exponential_think_time,
+    ),
+    'nosql': WorkloadSpec(
+        request=lambda rng: KV_REQUESTS[rng.randrange(len(KV_REQUESTS))],
+        response=4, # int result
+        think_time=exponential_think_time,
+    ),
+    'ml': WorkloadSpec(
+        request=lambda rng: ML_REQUESTS[rng.randrange(len(ML_REQUESTS))],
+        response=4 * ML_BATCH_SIZE, # int prediction per image of the batch
+        think_time=exponential_think_time,
+    ),
+}
+
+
+def interarrival_ns(rate, arrival, rng=random):
+    # Gap between two intended send times of an open-loop connection
+    if arrival == 'constant':
+        return int(1e9 / rate)
+    return int(rng.expovariate(rate) * 1e9)
+
+
+async def read_response(reader, response):
+    if isinstance(response, int):
+        return await reader.readexactly(response)
+    return await response(reader)
+
+
+async def read_first_response(reader, response):
+    # Response and the time its first byte arrived (ns), for the time to first byte of a connection. With a framing
+    # rule (variable sized responses), the time the whole response arrived
+    if isinstance(response, int):
+        first = await reader.readexactly(1)
+        first_byte_time = time.perf_counter_ns()
+        return first + await reader.readexactly(response - 1), first_byte_time
+    data = await response(reader)
+    return data, time.perf_counter_ns()
+
+
+async def connect(host, port, source=None, linger=None):
+    # Open a connection from a source address (if given) with the socket options of the benchmark:
+    # no Nagle delay, reusable local addresses and, with linger=0, a reset on close that leaves no TIME_WAIT socket
+    loop = asyncio.get_running_loop()
+    sock = socket.socket(socket.AF_INET6 if ':' in host else socket.AF_INET, socket.SOCK_STREAM)
+    try:
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        if linger is not None:
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_LINGER, struct.pack('ii', 1, linger))
+        if source is not None:
+            limits.bind_source(sock, source)
+        sock.setblocking(False)
+        await loop.sock_connect(sock, (host, port))
+    except BaseException:
+        sock.close()
+        raise
+    return await asyncio.open_connection(sock=sock)
+
+
+async def pipeline(spec, id, reader, writer, pending, window, recorder, schedule, request, rng, debug, switched_off=None):
+    # Keep up to window requests in flight on one connection. The sender queues the start time of every request
+    # it writes, and the receiver matches responses to them in FIFO order (the servers answer requests in order).
+    # pending survives reconnections: requests that were in flight are sent again first, keeping their start time.
+    # The first request of a connection goes alone (the ML server's first read takes up to 20 bytes, so
+    # it could merge several pipelined requests). Returns once switched off (closed-loop profile) and drained
+    loop = asyncio.get_running_loop()
+    slots = asyncio.Semaphore(1)
+    retries = deque(pending) # Start times of the requests to send again, in order (the receiver pops pending meanwhile)
+
+    async def send():
+        while True:
+            await slots.acquire()
+            if retries:
+                start = retries.popleft()
+            elif schedule is not None:
+                # Open loop: latency is measured from the intended send time, including the time spent
+                # waiting for a free slot in the window
+                start = await schedule()
+                pending.append(start)
+            elif switched_off is not None and switched_off():
+                return
+            else:
+                start = time.perf_counter_ns()
+                pending.append(start)
+                recorder.offer(start)
+            message = request()
+            recorder.capture(id, start, message)
+            writer.write(message)
+            await writer.drain()
+
+    async def receive():
+        first = True
+        while True:
+            response = await read_response(reader, spec.response)
+            request_start_time = pending.popleft()
+            request_duration = time.perf_counter_ns() - request_start_time
+
+            recorder.record(request_start_time, request_duration)
+            if debug:
+                print(f"Client {id} received: {response}")
+            if not pending and tasks[0].done():
+                return # Sender switched off, every request answered
+
+            # Open the rest of the window once the first response is back
+            if first:
+                first = False
+                for _ in range(window - 1):
+                    slots.release()
+            # Closed loop: every slot thinks before sending its next request
+            if schedule is None:
+                loop.call_later(spec.think_time(rng), slots.release)
+            else:
+                slots.release()
+
+    # Whichever fails first (e.g. the server closes the connection) stops the other one
+    tasks = (asyncio.create_task(send()), asyncio.create_task(receive()))
+    try:
+        done, _ = await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+        for task in done:
+            task.result()
+        # The sender was switched off: wait for the responses still on their way
+        if pending:
+            await tasks[1]
+    finally:
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+
+async def client(spec, id, host, port, deadline, recorder, rate=None, arrival='poisson', window=1, source=None, linger=None, profile=None, trace=None, seed=None, debug=False):
     error_abort = False
     error_reconnect = False
-    is_reconnecting = False
+    request_start_time = None # Set while a request is in flight, so that it is sent again with its start time after a reconnection
     reader, writer = None, None
+    loop = asyncio.get_running_loop()
+    # Every connection has its own generator, seeded from (seed, id) if a seed is given, so that runs with the same
+    # seed send the same requests at the same times
+    rng = random.Random(None if seed is None else f"{seed}:{id}")
+    pending = deque() # Start times of the requests in flight (pipelined connections)
+
+    # Replay: this connection sends the requests of its trace, (intended send time in ns, payload), open loop
+    replayed = iter(trace) if trace is not None else None
+    payload = None
+    open_loop = rate is not None or trace is not None
+
+    # Open loop: requests follow a schedule of intended send times (rate in req/s for this connection)
+    if rate is not None:
+        if arrival == 'constant':
+            next_send_time = time.perf_counter_ns() + int(rng.uniform(0, 1e9 / rate)) # Stagger connections
+        else:
+            next_send_time = time.perf_counter_ns() + interarrival_ns(rate, arrival, rng)
+
+    # Load profile (level of the load over time): an open-loop schedule is thinned, keeping the share of the
+    # send times given by the level (at random for poisson arrivals, evenly for constant ones)
+    credit = 0.0
+
+    def kept(send_time):
+        nonlocal credit
+        if profile is None:
+            return True
+        if arrival != 'constant':
+            return rng.random() < profile(send_time)
+        credit += profile(send_time)
+        if credit >= 1:
+            credit -= 1
+            return True
+        return False
+
+    async def schedule():
+        # Wait for the next intended send time and return it
+        # (the event loop clock is coarse, so a timer may wake up early)
+        nonlocal next_send_time, payload
+        while True:
+            if replayed is not None:
+                entry = next(replayed, None)
+                while entry is None: # Trace over, idle until the end of the run
+                    await asyncio.sleep(max(deadline - loop.time(), profiles.PROFILE_TICK))
+                next_send_time, payload = entry
+            while (delay := next_send_time - time.perf_counter_ns()) > 0:
+                await asyncio.sleep(delay * 1e-9)
+            send_time = next_send_time
+            if replayed is None:
+                next_send_time += interarrival_ns(rate, arrival, rng)
+            if kept(send_time):
+                recorder.offer(send_time)
+                return send_time
+
+    def request():
+        return payload if replayed is not None else spec.request(rng)
+
+    # A closed-loop profile switches connections on and off (closing them) to follow its level
+    switched_off = None
+    if profile is not None and rate is None:
+        switched_off = lambda: not profiles.active(id, profile(time.perf_counter_ns()))
+
+    while loop.time() < deadline:
+        # Stay disconnected while switched off
+        while switched_off is not None and switched_off() and loop.time() < deadline:
+            await asyncio.sleep(profiles.PROFILE_TICK)
+        if loop.time() >= deadline:
+            break
 
-    while asyncio.get_running_loop().time() < deadline:
         try:
-            # Connect to the server (with timeout)
+            # A single timeout for the whole connection, instead of one per request
             async with asyncio.timeout_at(deadline):
-                reader, writer = await asyncio.open_connection(host, port)
-            if debug:
-                print(f"Client {id} connected to {host}:{port}")
-
-            # Keep sending messages until time expires
-            while asyncio.get_running_loop().time() < deadline:
-                # Send a message
-                work_index = str(1)
-                value_index      = str(random.randint(0, 9))
-                message = work_index + value_index
-                
-                # Start measuring
-                if not is_reconnecting:
-                    request_start_time = time.perf_counter_ns()
-                writer.write(message.encode())
+                # Connect to the server
+                connect_start_time = time.perf_counter_ns()
+                reader, writer = await connect(host, port, source, linger)
+                recorder.phase('connect', connect_start_time, time.perf_counter_ns() - connect_start_time)
+                if debug:
+                    print(f"Client {id} connected to {host}:{port}" + (f" from {source}" if source else ""))
 
-                # Ensure data is sent (with timeout)
-                await writer.drain()
+                # Several requests in flight per connection (only ends by raising, like the loop below)
+                if window > 1:
+                    await pipeline(spec, id, reader, writer, pending, window, recorder, schedule if open_loop else None, request, rng, debug, switched_off)
+                    continue # Switched off
 
-                async with asyncio.timeout_at(deadline):    
-                    response = await reader.read(4)  # Adjust buffer size if needed
-                    request_duration = time.perf_counter_ns() - request_start_time
+                # Keep sending messages until time expires (or until switched off)
+                while switched_off is None or not switched_off():
+                    # Start measuring (unless retrying the request in flight when the connection was lost)
+                    if request_start_time is None and open_loop:
+                        # Wait for the intended send time. Latency is measured from it, so time spent
+                        # behind schedule (e.g. waiting on a slow response) counts towards the latency
+                        request_start_time = await schedule()
+                    elif request_start_time is None:
+                        request_start_time = time.perf_counter_ns()
+                        recorder.offer(request_start_time)
+                    message = request()
+                    recorder.capture(id, request_start_time, message)
 
-                if asyncio.get_running_loop().time() - request_duration * 1e-9 >= warmup_end:
-                    request_logs.append((request_start_time, request_duration))
-                    is_reconnecting = False
-                if debug:
-                    print(f"Client {id} received: {response}")
+                    # Send the request and read exactly one response
+                    writer.write(message)
+                    await writer.drain()
+                    response = await read_response(reader, spec.response)
+                    request_duration = time.perf_counter_ns() - request_start_time
 
-                # Delay to mimic real-world traffic patterns
-                async with asyncio.timeout_at(deadline):
-                    await asyncio.sleep(min(random.expovariate(1 / MEAN_DELAY), 10))
+                    # (the recorder leaves requests started during the warmup out of the results)
+                    recorder.record(request_start_time, request_duration)
+                    request_start_time = None
+                    if debug:
+                        print(f"Client {id} received: {response}")
 
-            if debug:
-                print(f"Client {id} finished at {asyncio.get_running_loop().time()}")
+                    # Delay to mimic real-world traffic patterns
+                    if not open_loop:
+                        await asyncio.sleep(spec.think_time(rng))
 
         except asyncio.TimeoutError as e:
             if debug:
-                print(f"(to) Client {id} finished at {asyncio.get_running_loop().time()}")
+                print(f"(to) Client {id} finished at {loop.time()}")
             break
-        except ConnectionError as e:
+        except (ConnectionError, asyncio.IncompleteReadError) as e:
             error_reconnect = True
-            is_reconnecting = True
+            recorder.error()
             if debug:
-                print(f"Client {id} encountered a recoverable error: {e}\nReconnecting...")
+                print(f"Client {id} encountered a recoverable error: {e!r}\nReconnecting...")
         except Exception as e:
             error_abort = True
-            is_reconnecting = True
+            recorder.error(abort=True)
             if debug:
-                print(f"Client {id} encountered an unrecoverable error: {e}\nAborting...")
+                print(f"Client {id} encountered an unrecoverable error: {e!r}\nAborting...")
         finally:
             if writer and not writer.is_closing():
                 writer.close()
-                await writer.wait_closed()
-
-    return request_logs, error_abort, error_reconnect
+                try:
+                    await writer.wait_closed()
+                except ConnectionError:
+                    pass
 
+    return error_abort, error_reconnect
 
-async def client_nosql(id, start_time, host, port, warmup_d, total_d, debug=False):
-    ...
 
-
-async def client_ws(id, start_time, host, port, warmup_d, total_d, debug=False):
-    ...
-
-
-async def client_da(id, start_time, host, port, warmup_d, total_d, debug=False):
-    ...
-
-
-async def client_ml(id, host, port, warmup_end, deadline, debug=False):
-    request_logs = []
+async def churn_client(spec, id, host, port, deadline, recorder, rate=None, arrival='poisson', requests=1, source=None, linger=None, seed=None, debug=False):
+    # Short-lived connections: every session connects, sends 1 to requests requests (at random) one after the other
+    # and closes. Sessions of this slot arrive at rate (sessions/s, open loop) or, without a rate, follow each other
+    # after a think time (closed loop). Besides the latency of every request, a session records its connect latency
+    # and its time to first byte, from the start of the session to the first byte of its first response, which
+    # includes the setup of the connection by the server (e.g. a thread per accepted socket). In open loop a session
+    # starts at its intended start time, so sessions behind schedule count towards the time to first byte
     error_abort = False
     error_reconnect = False
-    is_reconnecting = False
-    reader, writer = None, None
+    loop = asyncio.get_running_loop()
+    rng = random.Random(None if seed is None else f"{seed}:{id}")
 
-    while asyncio.get_running_loop().time() < deadline:
+    if rate is not None:
+        if arrival == 'constant':
+            next_start_time = time.perf_counter_ns() + int(rng.uniform(0, 1e9 / rate)) # Stagger slots
+        else:
+            next_start_time = time.perf_counter_ns() + interarrival_ns(rate, arrival, rng)
+
+    while loop.time() < deadline:
+        writer = None
         try:
-            # Connect to the server (with timeout)
             async with asyncio.timeout_at(deadline):
-                reader, writer = await asyncio.open_connection(host, port)
-            if debug:
-                print(f"Client {id} connected to {host}:{port}")
-
-            # Keep sending messages until time expires
-            while asyncio.get_running_loop().time() < deadline:
-                # Send a message
-                message = str(random.randint(0, 9999))
-                
-                # Start measuring
-                if not is_reconnecting:
-                    request_start_time = time.perf_counter_ns()
-                writer.write(message.encode())
-
-                # Ensure data is sent (with timeout)
-                await writer.drain()
-
-                async with asyncio.timeout_at(deadline):    
-                    response = await reader.read(100)  # Adjust buffer size if needed
-                    request_duration = time.perf_counter_ns() - request_start_time
+                # Wait for the intended start of the session
+                if rate is not None:
+                    while (delay := next_start_time - time.perf_counter_ns()) > 0:
+                        await asyncio.sleep(delay * 1e-9)
+                    session_start_time = next_start_time
+                    next_start_time += interarrival_ns(rate, arrival, rng)
+                else:
+                    session_start_time = time.perf_counter_ns()
 
-                if asyncio.get_running_loop().time() - request_duration * 1e-9 >= warmup_end:
-                    request_logs.append((request_start_time, request_duration))
-                    is_reconnecting = False
+                connect_start_time = time.perf_counter_ns()
+                reader, writer = await connect(host, port, source, linger)
+                recorder.phase('connect', connect_start_time, time.perf_counter_ns() - connect_start_time)
                 if debug:
-                    print(f"Client {id} received: {response}")
+                    print(f"Client {id} connected to {host}:{port}" + (f" from {source}" if source else ""))
 
-                # Delay to mimic real-world traffic patterns
-                async with asyncio.timeout_at(deadline):
-                    await asyncio.sleep(min(random.expovariate(1 / MEAN_DELAY), 10))
-
-            if debug:
-                print(f"Client {id} finished at {asyncio.get_running_loop().time()}")
+                for i in range(rng.randint(1, requests)):
+                    request_start_time = time.perf_counter_ns()
+                    recorder.offer(request_start_time)
+                    writer.write(spec.request(rng))
+                    await writer.drain()
+                    if i == 0:
+                        response, first_byte_time = await read_first_response(reader, spec.response)
+                        recorder.phase('ttfb', session_start_time, first_byte_time - session_start_time)
+                    else:
+                        response = await read_response(reader, spec.response)
+                    recorder.record(request_start_time, time.perf_counter_ns() - request_start_time)
+                    if debug:
+                        print(f"Client {id} received: {response}")
 
-        except asyncio.TimeoutError as e:
-            if debug:
-                print(f"(to) Client {id} finished at {asyncio.get_running_loop().time()}")
+        except asyncio.TimeoutError:
             break
-        except ConnectionError as e:
+        except (ConnectionError, asyncio.IncompleteReadError) as e:
             error_reconnect = True
-            is_reconnecting = True
+            recorder.error()
             if debug:
-                print(f"Client {id} encountered a connection error: {e}\nReconnecting...")
+                print(f"Client {id} encountered a recoverable error: {e!r}\nReconnecting...")
         except Exception as e:
             error_abort = True
-            is_reconnecting = True
+            recorder.error(abort=True)
             if debug:
-                print(f"Client {id} encountered an error: {e}\nAborting...")
+                print(f"Client {id} encountered an unrecoverable error: {e!r}\nAborting...")
         finally:
             if writer and not writer.is_closing():
                 writer.close()
-                await writer.wait_closed()
-
-    return request_logs, error_abort, error_reconnect
-
-
-def get_client_method(workload):
-    if workload == 'rdb':
-        return client_rdb
-    elif workload == 'nosql':
-        return client_nosql
-    elif workload == 'ws':
-        return client_ws
-    elif workload == 'da':
-        return client_da
-    elif workload == 'ml':
-        return client_ml
+                try:
+                    await writer.wait_closed()
+                except ConnectionError:
+                    pass
+
+        # Closed loop: think before the next session
+        if rate is None:
+            await asyncio.sleep(min(spec.think_time(rng), max(deadline - loop.time(), 0)))
+
+    return error_abort, error_reconnect
+
+
+def probe(workload):
+    # First request sent to a server to check that it responds, and the size of its response in bytes
+    spec = SPECS.get(workload)
+    if spec is None or not isinstance(spec.response, int):
+        return None
+    return spec.request(random), spec.response
+
+
+def get_client_method(workload, churn=False):
+    if workload not in SPECS:
+        raise ValueError(f"No client spec for workload '{workload}', add one to clients.SPECS.")
+    return partial(churn_client if churn else client, SPECS[workload])
@@ -0,0 +1,241 @@
+import numpy as np
+from array import array
+
+
+# Log-linear (HDR style) buckets for latencies in ns: every value below 2^SUB_BUCKET_BITS has its own
+# bucket and each following power of two is split into SUB_BUCKET_HALF buckets, so the relative error
+# of any recorded value is below 1 / SUB_BUCKET_HALF (< 0.8%)
+SUB_BUCKET_BITS = 8
+SUB_BUCKET_COUNT = 1 << SUB_BUCKET_BITS
+SUB_BUCKET_HALF = SUB_BUCKET_COUNT >> 1
+MAX_VALUE_BITS = 40 # ~18 minutes in ns, values above are clamped
+MAX_VALUE = (1 << MAX_VALUE_BITS) - 1
+N_BUCKETS = (MAX_VALUE_BITS - SUB_BUCKET_BITS + 2) * SUB_BUCKET_HALF
+# Intervals of a timeline whose latency histograms are kept whole while their requests complete
+OPEN_INTERVALS = 16
+
+
+def bucket_index(value):
+    if value < SUB_BUCKET_COUNT:
+        return max(value, 0)
+    if value > MAX_VALUE:
+        value = MAX_VALUE
+    shift = value.bit_length() - SUB_BUCKET_BITS
+    return shift * SUB_BUCKET_HALF + (value >> shift)
+
+
+def bucket_bounds():
+    # Lowest and highest value (ns) that falls in each bucket
+    index = np.arange(N_BUCKETS, dtype=np.int64)
+    shift = np.maximum(index // SUB_BUCKET_HALF - 1, 0)
+    lower = (index - shift * SUB_BUCKET_HALF) << shift
+    upper = lower + (np.int64(1) << shift) - 1
+    return lower, upper
+
+
+BUCKET_LOWER, BUCKET_UPPER = bucket_bounds()
+BUCKET_MID = (BUCKET_LOWER + BUCKET_UPPER) / 2
+
+
+def counts_percentiles(counts, ps):
+    # Value (ns) at each percentile in ps of a bucket count vector, or of every row of a 2D array of them
+    counts = np.asarray(counts)
+    cum = np.cumsum(np.atleast_2d(counts), axis=1)
+    total = cum[:, -1]
+    ranks = np.maximum(np.ceil(np.outer(total, ps) / 100), 1)
+    index = np.array([np.searchsorted(c, r) for c, r in zip(cum, ranks)])
+    values = np.where(total[:, None] > 0, BUCKET_MID[np.minimum(index, N_BUCKETS - 1)], np.nan)
+    return values if counts.ndim > 1 else values[0]
+
+
+def compact_counts(counts):
+    # Nonzero buckets of a count vector, (indices, counts): usually a few hundred values instead of N_BUCKETS
+    counts = np.asarray(np.frombuffer(counts, dtype=np.int64) if isinstance(counts, array) else counts, dtype=np.int64)
+    index = np.flatnonzero(counts).astype(np.int32)
+    return index, counts[index]
+
+
+def expand_counts(compact):
+    index, values = compact
+    counts = np.zeros(N_BUCKETS, dtype=np.int64)
+    counts[index] = values
+    return counts
+
+
+def sparse_rows(rows):
+    # Nonzero buckets of a matrix of histograms (one per row) as (row, bucket, count) triplets, e.g. the histograms of
+    # the intervals of a timeline, which are almost all zeros
+    row, bucket = np.nonzero(rows)
+    return np.stack([row, bucket, rows[row, bucket]], axis=1).astype(np.int64)
+
+
+def dense_rows(entries, n_rows):
+    rows = np.zeros((n_rows, N_BUCKETS), dtype=np.int64)
+    entries = np.asarray(entries)
+    rows[entries[:, 0], entries[:, 1]] = entries[:, 2]
+    return rows
+
+
+class Histogram:
+    __slots__ = ('counts', 'total', 'sum', 'min', 'max')
+
+    def __init__(self):
+        self.counts = array('q', bytes(8 * N_BUCKETS)) # Preallocated, recording never allocates
+        self.total = 0
+        self.sum = 0
+        self.min = MAX_VALUE
+        self.max = 0
+
+    def __getstate__(self):
+        return self.counts, self.total, self.sum, self.min, self.max
+
+    def __setstate__(self, state):
+        self.counts, self.total, self.sum, self.min, self.max = state
+
+    def record(self, value):
+        if value < SUB_BUCKET_COUNT:
+            self.counts[max(value, 0)] += 1
+        else:
+            self.counts[bucket_index(value)] += 1
+        self.total += 1
+        self.sum += value
+        if value < self.min:
+            self.min = value
+        if value > self.max:
+            self.max = value
+
+    def merge(self, other):
+        counts = np.frombuffer(self.counts, dtype=np.int64)
+        counts += np.frombuffer(other.counts, dtype=np.int64)
+        self.total += other.total
+        self.sum += other.sum
+        self.min = min(self.min, other.min)
+        self.max = max(self.max, other.max)
+        return self
+
+    @classmethod
+    def from_state(cls, counts, state):
+        h = cls()
+        h.counts = array('q', np.asarray(counts, dtype=np.int64).tobytes())
+        h.total, h.sum, h.min, h.max = state['total'], state['sum'], state['min'], state['max']
+        return h
+
+    def state(self):
+        # Scalars that go with the bucket counts
+        return {'total': self.total, 'sum': self.sum, 'min': self.min, 'max': self.max}
+
+    def summary(self, ps):
+        # Mean, std, min, max and percentiles (ns)
+        if not self.total:
+            return np.nan, np.nan, np.nan, np.nan, np.full(len(ps), np.nan)
+        return self.mean(), self.std(), self.min, self.max, self.percentiles(ps)
+
+    def mean(self):
+        return self.sum / self.total if self.total else np.nan
+
+    def std(self):
+        if not self.total:
+            return np.nan
+        counts = np.frombuffer(self.counts, dtype=np.int64)
+        return np.sqrt(np.dot(counts, (BUCKET_MID - self.mean()) ** 2) / self.total)
+
+    def percentiles(self, ps):
+        # Clamp to the exact extremes so that p0/p100 are not bucket approximations
+        return np.clip(counts_percentiles(np.frombuffer(self.counts, dtype=np.int64), ps), self.min, self.max)
+
+    def percentile(self, p):
+        return float(self.percentiles([p])[0])
+
+
+class Timeline:
+    __slots__ = ('epoch', 'interval', 'counts', 'sums', 'open', 'open_intervals', 'closed', 'late', 'offered', 'completed')
+
+    # Number of requests, sum of their latencies (ns) and latency histogram per time bucket of `interval` ns, by
+    # request start time. Also the requests offered (due to be sent, by intended send time) and completed (by response
+    # time) per bucket, i.e. the offered and achieved load. Only the histograms of the last OPEN_INTERVALS intervals
+    # are whole (preallocated ring of N_BUCKETS counts each), older ones are closed to their nonzero buckets
+    def __init__(self, epoch, interval, n_intervals):
+        self.epoch = epoch
+        self.interval = interval
+        self.counts = array('q', bytes(8 * n_intervals))
+        self.sums = array('q', bytes(8 * n_intervals))
+        self.set_histograms(np.zeros((0, 3), dtype=np.int64))
+        self.offered = array('q', bytes(8 * n_intervals))
+        self.completed = array('q', bytes(8 * n_intervals))
+
+    def __getstate__(self):
+        return self.epoch, self.interval, self.counts, self.sums, self.histogram_entries(), self.offered, self.completed
+
+    def __setstate__(self, state):
+        self.epoch, self.interval, self.counts, self.sums, entries, self.offered, self.completed = state
+        self.set_histograms(entries)
+
+    def set_histograms(self, entries):
+        # Histograms given as (interval, bucket, count) triplets, all of them closed
+        self.open = array('q', bytes(8 * OPEN_INTERVALS * N_BUCKETS))
+        self.open_intervals = [-1] * OPEN_INTERVALS
+        self.closed = [np.asarray(entries, dtype=np.int64).reshape(-1, 3)]
+        self.late = {} # (interval, bucket): count, requests that started in an interval closed already
+
+    def record(self, start, value):
+        i = (start - self.epoch) // self.interval
+        if 0 <= i < len(self.counts):
+            self.counts[i] += 1
+            self.sums[i] += value
+            slot = i % OPEN_INTERVALS
+            if self.open_intervals[slot] < i:
+                self.close(slot)
+                self.open_intervals[slot] = i
+            if self.open_intervals[slot] == i:
+                self.open[slot * N_BUCKETS + bucket_index(value)] += 1
+            else:
+                key = (i, bucket_index(value))
+                self.late[key] = self.late.get(key, 0) + 1
+        i = (start + value - self.epoch) // self.interval
+        if 0 <= i < len(self.completed):
+            self.completed[i] += 1
+
+    def offer(self, start):
+        i = (start - self.epoch) // self.interval
+        if 0 <= i < len(self.offered):
+            self.offered[i] += 1
+
+    def close(self, slot):
+        # Keep the nonzero buckets of the interval in the slot and clear it for the next one
+        if self.open_intervals[slot] < 0:
+            return
+        row = np.frombuffer(self.open, dtype=np.int64)[slot * N_BUCKETS:(slot + 1) * N_BUCKETS]
+        entries = sparse_rows(row[None])
+        entries[:, 0] = self.open_intervals[slot]
+        self.closed.append(entries)
+        row[:] = 0
+
+    def histogram_entries(self):
+        # Nonzero buckets of the histograms of all intervals as (interval, bucket, count) triplets, by interval and bucket
+        entries = sparse_rows(np.frombuffer(self.open, dtype=np.int64).reshape(OPEN_INTERVALS, N_BUCKETS))
+        entries[:, 0] = np.asarray(self.open_intervals)[entries[:, 0]]
+        late = np.array([(i, bucket, count) for (i, bucket), count in self.late.items()], dtype=np.int64).reshape(-1, 3)
+        entries = np.concatenate([*self.closed, entries, late])
+        # The same bucket of an interval can appear more than once (late requests, merged timelines)
+        keys, index = np.unique(entries[:, 0] * N_BUCKETS + entries[:, 1], return_inverse=True)
+        counts = np.zeros(len(keys), dtype=np.int64)
+        np.add.at(counts, index.ravel(), entries[:, 2])
+        return np.stack([keys // N_BUCKETS, keys % N_BUCKETS, counts], axis=1)
+
+    def merge(self, other):
+        # Timelines of different processes are aligned on their own epochs
+        n = max(len(self.counts), len(other.counts))
+        columns = {name: np.zeros(n, dtype=np.int64) for name in ('counts', 'sums', 'offered', 'completed')}
+        for t in (self, other):
+            for name, column in columns.items():
+                values = getattr(t, name)
+                column[:len(values)] += np.frombuffer(values, dtype=np.int64)
+        for name, column in columns.items():
+            setattr(self, name, array('q', column.tobytes()))
+        self.set_histograms(np.concatenate([self.histogram_entries(), other.histogram_entries()]))
+        self.epoch = min(self.epoch, other.epoch)
+        return self
+
+    def columns(self):
+        # Requests, latency sums, offered and completed requests of every interval, one row each
+        return np.stack([np.frombuffer(getattr(self, name), dtype=np.int64) for name in ('counts', 'sums', 'offered', 'completed')], axis=1)
@@ -0,0 +1,68 @@
+import ipaddress
+import netstat
+import resource
+import socket
+
+
+FD_MARGIN = 100 # File descriptors needed besides the connections (std streams, pipes, shared memory...)
+MAX_NETWORK_SOURCES = 1024 # Source addresses taken from each network given as a source (e.g. 127.0.0.0/8)
+IP_BIND_ADDRESS_NO_PORT = getattr(socket, 'IP_BIND_ADDRESS_NO_PORT', 24) # Linux
+
+
+def parse_sources(sources):
+    # Addresses and networks such as '127.0.0.2,127.0.1.0/24' -> list of addresses
+    result = []
+    for part in sources.split(','):
+        if '/' in part:
+            network = ipaddress.ip_network(part, strict=False)
+            for i, address in enumerate(network.hosts()):
+                if i >= MAX_NETWORK_SOURCES: break
+                result.append(str(address))
+        else:
+            result.append(str(ipaddress.ip_address(part)))
+    return result
+
+
+def bind_source(sock, source):
+    # Bind to the source address only: the port is picked at connect time, so that every
+    # (source, destination) pair gets a whole ephemeral port range instead of every source
+    try:
+        sock.setsockopt(socket.IPPROTO_IP, IP_BIND_ADDRESS_NO_PORT, 1)
+    except OSError:
+        pass
+    sock.bind((source, 0))
+
+
+def port_capacity(sources=None, ports=None):
+    # Concurrent connections the local ephemeral port range allows towards one host
+    return netstat.ephemeral_ports() * len(sources or [None]) * len(ports or [None])
+
+
+def raise_fd_limit(needed):
+    # Raise the soft limit of open files to needed, and the hard limit too if allowed (root). Limits are never lowered
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    if soft == resource.RLIM_INFINITY or soft >= needed:
+        return soft
+    if hard != resource.RLIM_INFINITY and hard < needed:
+        try:
+            resource.setrlimit(resource.RLIMIT_NOFILE, (needed, needed))
+            return needed
+        except (ValueError, OSError):
+            raise RuntimeError(f"{needed} file descriptors are needed, but the hard limit is {hard} and cannot be raised. Raise it (ulimit -Hn, /etc/security/limits.conf, fs.nr_open) or run as root.")
+    resource.setrlimit(resource.RLIMIT_NOFILE, (needed, hard))
+    return needed
+
+
+def preflight(connections, host, sources=None, ports=None):
+    # Check up front that the client host can hold the connections of a run, instead of failing halfway through it
+    family = socket.AF_INET6 if ':' in host else socket.AF_INET
+    for source in sources or []:
+        with socket.socket(family, socket.SOCK_STREAM) as sock:
+            try:
+                bind_source(sock, source)
+            except OSError as e:
+                raise RuntimeError(f"Cannot bind source address {source} ({e.strerror}). It has to be configured on a local interface (e.g. ip addr add {source}/32 dev lo).")
+    capacity = port_capacity(sources, ports)
+    if connections > capacity:
+        raise RuntimeError(f"{connections} connections do not fit in the ephemeral port range ({netstat.ephemeral_ports()} ports per source address and destination port, {capacity} in total). Add source addresses or destination ports, or widen net.ipv4.ip_local_port_range.")
+    return raise_fd_limit(connections + FD_MARGIN)
@@ -0,0 +1,111 @@
+import json
+import numpy as np
+import storage
+import sys
+import threading
+import time
+from histogram import N_BUCKETS, counts_percentiles
+from multiprocessing.shared_memory import SharedMemory
+from pathlib import Path
+
+
+# Live metrics of a run: every worker process publishes cumulative counters and a latency histogram in its own row
+# of a shared memory block (only the worker writes its row, so no locks are needed), and a thread of the parent
+# reads all the rows every LIVE_INTERVAL. The difference between two readings gives the metrics of the last interval
+LIVE_INTERVAL = 1.0 # s
+COMPLETED, OFFERED, ABORTS, RECONNECTS = range(4)
+HEADER = 4 # Counters before the histogram in a row
+ROW = HEADER + N_BUCKETS
+
+
+def create(n_workers):
+    # Shared memory block of the counters of n_workers, zeroed
+    return SharedMemory(create=True, size=8 * ROW * n_workers)
+
+
+def attach(name, row):
+    # Counters of one worker (memoryview of int64), with the shared memory block to close when done
+    shm = SharedMemory(name=name)
+    return shm, shm.buf.cast('q')[row * ROW:(row + 1) * ROW]
+
+
+def prometheus(metrics, labels):
+    # Prometheus text exposition format (e.g. for the textfile collector of node_exporter)
+    labels = ','.join(f'{k}="{v}"' for k, v in labels.items() if v is not None)
+    lines = []
+    typed = set()
+    for name, kind, value, extra in [
+        ('bench_throughput_requests_per_second', 'gauge', metrics['throughput'], ''),
+        ('bench_offered_requests_per_second', 'gauge', metrics['offered'], ''),
+        ('bench_latency_seconds', 'gauge', metrics['p50'], ',quantile="0.5"'),
+        ('bench_latency_seconds', 'gauge', metrics['p99'], ',quantile="0.99"'),
+        ('bench_requests_total', 'counter', metrics['completed'], ''),
+        ('bench_aborts_total', 'counter', metrics['aborts'], ''),
+        ('bench_reconnects_total', 'counter', metrics['reconnects'], ''),
+    ]:
+        if name not in typed:
+            typed.add(name)
+            lines.append(f"# TYPE {name} {kind}\n")
+        lines.append(f"{name}{{{labels}{extra}}} {'NaN' if value is None else value}\n")
+    return ''.join(lines)
+
+
+class Monitor(threading.Thread):
+    # Aggregates the counters of all the workers every interval: a status line on stderr (view) and/or a metrics
+    # file, JSON lines appended every interval or, for a .prom file, the latest metrics in Prometheus format
+    def __init__(self, shm, n_workers, warmup, labels, view=False, path=None, interval=LIVE_INTERVAL):
+        super().__init__(daemon=True)
+        self.counters = np.ndarray((n_workers, ROW), dtype=np.int64, buffer=shm.buf)
+        self.warmup = warmup
+        self.labels = labels
+        self.view = view
+        self.path = Path(path) if path is not None else None
+        self.interval = interval
+        self.start_time = time.perf_counter()
+        self.last = self.start_time
+        self.previous = np.zeros(ROW, dtype=np.int64)
+        self._stop_event = threading.Event()
+
+    def run(self):
+        while not self._stop_event.wait(self.interval):
+            self.report()
+
+    def report(self):
+        now = time.perf_counter()
+        elapsed, self.last = now - self.last, now
+        totals = self.counters.sum(axis=0)
+        delta = totals - self.previous
+        self.previous = totals
+        p50, p99 = counts_percentiles(delta[HEADER:], [50, 99]) * 1e-9
+        t = now - self.start_time
+        metrics = {
+            'time': time.time(),
+            'elapsed': round(t, 3),
+            'phase': 'warmup' if t < self.warmup else 'measurement',
+            **self.labels,
+            'throughput': delta[COMPLETED] / elapsed,
+            'offered': delta[OFFERED] / elapsed,
+            'p50': None if np.isnan(p50) else p50,
+            'p99': None if np.isnan(p99) else p99,
+            'completed': int(totals[COMPLETED]),
+            'aborts': int(totals[ABORTS]),
+            'reconnects': int(totals[RECONNECTS]),
+        }
+        if self.view:
+            latency = f"p50 {p50 * 1e3:7.2f} ms  p99 {p99 * 1e3:7.2f} ms" if metrics['p50'] is not None else f"{'no responses':>31}"
+            sys.stderr.write(f"\r{t:5.0f} s {metrics['phase']:<11}  {metrics['throughput']:9.0f} req/s (offered {metrics['offered']:.0f})  {latency}  aborts {metrics['aborts']}  reconnects {metrics['reconnects']} ")
+            sys.stderr.flush()
+        if self.path is not None and self.path.suffix == '.prom':
+            storage.atomic_write(self.path, lambda file: file.write(prometheus(metrics, self.labels).encode()))
+        elif self.path is not None:
+            with open(self.path, 'a') as file:
+                file.write(json.dumps(metrics) + '\n')
+
+    def stop(self):
+        self._stop_event.set()
+        self.join()
+        self.report() # Rest of the run since the last interval
+        self.counters = None # Release the shared memory
+        if self.view:
+            sys.stderr.write('\n')
+            sys.stderr.flush()
@@ -1,10 +1,23 @@
+import agent
 import argparse
 import asyncio
 import bench
-import resource
+import clients
+import itertools
+import json
+import limits
+import live
+import numpy as np
+import profiles
+import readiness
+import standin
+import storage
 import subprocess
+import sys
 import time
+import traces
 import uvloop
+from histogram import Histogram
 from pathlib import Path
 from tqdm import tqdm
 
@@ -17,83 +30,244 @@ WORKLOADS = {
     'da': 'data_analytics', 
     'ml': 'machine_learning'
 }
-COOLDOWN = 5
 DEFAULT_DURATION = 60
 START = 100
 STOP = 1600 # Included
 STEP = 150
+OPEN_LOOP_CONNECTIONS = 100
+SEARCH_TOLERANCE = 0.05
 
-# Maximum number of file descriptors (sockets in this case) that we can open 
-MAX_FD = STOP + 100
-resource.setrlimit(resource.RLIMIT_NOFILE, (MAX_FD, MAX_FD))
+# Runtime configurations benchmarked as separate series (see --runtimes): series name -> runtime (None for the native
+# binary of the workload, else an iwasm build), module (wasm or AOT module, {w} = workload folder name) and extra
+# runtime flags (e.g. heap or stack sizes). Relative paths are looked up in the build folder of every workload
+RUNTIMES = {
+    'native': {'runtime': None},
+    'wasm': {'runtime': 'iwasm', 'module': '{w}.wasm', 'flags': []},
+}
+WAMRC = 'wamrc' # AOT compiler of WAMR, for .aot modules that are not built yet
+CALIBRATION_SERIES = 'calibration' # Series of the stand-in servers (see --calibrate)
 
 # More efficient event loop for asyncio
 asyncio.set_event_loop_policy(uvloop.EventLoopPolicy())
 
 
-def main(workloads, durations, host, port):
-    # Gather workload executables
-    native_exes = []
-    wasm_exes = []
-    runtimes = []
+def load_runtimes(path):
+    # Runtime matrix (JSON file): every combination of one runtime build, one module and one set of flags is a series, e.g.
+    # {"native": true, "runtime": {"interp": "iwasm", "jit": "/opt/iwasm-jit/iwasm"}, "module": {"": "{w}.wasm", "aot": "{w}.aot"},
+    #  "flags": {"": [], "heap64m": ["--heap-size=67108864"]}, "wamrc": ["wamrc", "--opt-level=3"]}
+    # Series are named after the (non-empty) names of their runtime, module and flags, e.g. wasm-jit-aot-heap64m
+    with open(path) as file:
+        matrix = json.load(file)
+    runtimes = {'native': {'runtime': None}} if matrix.get('native', True) else {}
+    for (r_name, runtime), (m_name, module), (f_name, flags) in itertools.product(
+        matrix.get('runtime', {'': 'iwasm'}).items(),
+        matrix.get('module', {'': '{w}.wasm'}).items(),
+        matrix.get('flags', {'': []}).items(),
+    ):
+        name = '-'.join(['wasm'] + [n for n in (r_name, m_name, f_name) if n])
+        runtimes[name] = {'runtime': runtime, 'module': module, 'flags': flags, 'wamrc': matrix.get('wamrc', [WAMRC])}
+    return runtimes
+
+
+def server_command(build_dir, runtime):
+    # Function of the number of connections returning the arguments that launch the server of a series
+    w_dir_name = build_dir.parent.name
+    if runtime['runtime'] is None:
+        nexe = build_dir / w_dir_name
+        assert nexe.exists(), f"Missing native binary for workload {w_dir_name}."
+        return lambda c: [nexe]
+
+    iwasm = build_dir / runtime['runtime'] # Absolute paths are kept as they are
+    module = build_dir / runtime['module'].format(w=w_dir_name)
+    assert iwasm.exists(), f"Missing runtime {iwasm} for workload {w_dir_name}."
+    if module.suffix == '.aot':
+        # Compile the AOT module with wamrc if it is missing or older than the wasm module
+        wexe = build_dir / f"{w_dir_name}.wasm"
+        assert wexe.exists(), f"Missing wasm binary for workload {w_dir_name}."
+        if not module.exists() or module.stat().st_mtime < wexe.stat().st_mtime:
+            subprocess.run([*runtime.get('wamrc', [WAMRC]), '-o', module, wexe], check=True)
+    assert module.exists(), f"Missing module {module.name} for workload {w_dir_name}."
+    return lambda c: [iwasm, "--dir=.", f"--max-threads={c + 10}", "--addr-pool=0.0.0.0/15", *runtime.get('flags', []), module]
+
+
+def standin_command(w, port, server_cpus=None):
+    # Arguments that launch the stand-in server of a workload (one process per server CPU if they are pinned)
+    script = Path(__file__).parent / "standin.py"
+    processes = len(server_cpus) if server_cpus else standin.DEFAULT_PROCESSES
+    return lambda c: [Path(sys.executable), script, '-w', w, '-p', port, '-P', str(processes)]
+
+
+def calibration_summary(results):
+    # Generator limits found by a calibration sweep: its highest throughput and its lowest latencies
+    results = [(meta, h) for meta, h in results if h.total and not meta['error_abort']]
+    if not results:
+        return None
+    return {
+        'max throughput (req/s)': max(h.total / meta['duration'] for meta, h in results),
+        'latency floor 50% (s)': min(h.percentile(50) for _, h in results) * 1e-9,
+        'latency floor 99% (s)': min(h.percentile(99) for _, h in results) * 1e-9,
+        'runs': len(results),
+    }
+
+
+def main(workloads, durations, host, port, rates=None, connections=OPEN_LOOP_CONNECTIONS, arrival='poisson', raw=False, drain=False, slo=None, tolerance=SEARCH_TOLERANCE, repeat=1, label=None, force=False, server_cpus=None, runtimes=RUNTIMES, calibrate=False, bench_options={}):
+    # Gather workload build folders (the stand-ins of a calibration run from here and need none)
+    build_dirs = {}
     full_w_names = {WORKLOADS[w] for w in workloads}
+    if calibrate:
+        build_dirs = {w_name: Path(__file__).parent for w_name in full_w_names}
+        full_w_names = set()
     workloads_dir = Path(__file__).parents[2] / "workloads"
     for w_dir in workloads_dir.iterdir():
-        if w_dir.is_dir():
-            w_dir_name = w_dir.name
-            if w_dir_name in full_w_names:
-                nexe = w_dir / "build" / w_dir_name
-                wexe = w_dir / "build" / f"{w_dir_name}.wasm"
-                iwasm = w_dir / "build" / "iwasm"
-                assert nexe.exists(), f"Missing native binary for workload {w_dir_name}."
-                assert wexe.exists(), f"Missing wasm binary for workload {w_dir_name}."
-                assert iwasm.exists(), f"Missing runtime for workload {w_dir_name}."
-                native_exes.append(nexe)
-                wasm_exes.append(wexe)
-                runtimes.append(iwasm)
-                full_w_names.remove(w_dir_name)
+        if w_dir.is_dir() and w_dir.name in full_w_names:
+            build_dirs[w_dir.name] = w_dir / "build"
+            full_w_names.remove(w_dir.name)
     
     assert len(full_w_names) == 0, f"Missing folders for the following workloads: [" + ", ".join(full_w_names) + "]." 
 
+    # Server command of every (workload, series), checked (and AOT modules compiled) before anything runs
+    if calibrate:
+        for w in workloads:
+            standin.protocol(w) # Raises for workloads without a stand-in
+        runtimes = {CALIBRATION_SERIES: {'runtime': None}}
+        commands = {(w, CALIBRATION_SERIES): standin_command(w, port, server_cpus) for w in workloads}
+    else:
+        commands = {(w, series): server_command(build_dirs[WORKLOADS[w]], runtime) for w in workloads for series, runtime in runtimes.items()}
+
+    # Load levels (connections, offered load): either a connection sweep (closed loop) or an offered load sweep (open loop)
+    if bench_options.get('trace') is not None:
+        levels = [(traces.trace_info(bench_options['trace'])[0], None)] # One replay, a connection per connection of the trace
+    elif rates is None:
+        levels = [(c, None) for c in range(START, STOP+STEP, STEP)]
+    else:
+        levels = [(connections, round(float(r), 6)) for r in np.arange(rates[0], rates[1] + rates[2] / 2, rates[2])]
+
+    # Check that the largest run fits in the ports and file descriptors of this host before starting. The servers
+    # inherit the raised file descriptor limit
+    max_connections = STOP if slo is not None and rates is None else max(c for c, _ in levels)
+    sources = bench_options.get('sources')
+    if bench_options.get('agents'):
+        limits.raise_fd_limit(max_connections + limits.FD_MARGIN) # Only the server's connections are on this host
+    else:
+        limits.preflight(max_connections, host, sources)
+
+    # TIME_WAIT sockets left by a run hold client ports, wait until enough are free for the largest run
+    max_time_wait = 0 if drain else max(limits.port_capacity(sources) - max_connections, 0)
+
+    # Results of this session go to their own folder. Run points already completed in it are skipped (unless forced)
+    label = label or time.strftime('%Y%m%d-%H%M%S')
+    tqdm.write(f"Session: {label}")
+
     # Run benchmarks for varying loads
-    for w, d, nexe, wexe, runtime in zip(workloads, durations, native_exes, wasm_exes, runtimes):
-        # Native
-        for connections in tqdm(range(START, STOP+STEP, STEP), desc=WORKLOADS[w]):
-            # Launch server
-            server_process = subprocess.Popen(
-                args=nexe, 
-                cwd=nexe.parent,
-                close_fds=True, # Ensures no file descriptors are inherited
-                start_new_session=True # Detaches the process completely
-            )
-            time.sleep(1)
-            # Run benchmark
-            error = asyncio.run(bench.bench(w, False, d, connections, host, port))
-            time.sleep(0.1)
-            # Terminate server
-            if server_process != None:
-                server_process.terminate()
-            time.sleep(COOLDOWN)
-            if error: break
-        
-        # Wasm
-        for connections in tqdm(range(START, STOP+STEP, STEP), desc=WORKLOADS[w]+".wasm"):
-            # Launch server
-            server_process = subprocess.Popen(
-                args=[runtime, "--dir=.", f"--max-threads={connections + 10}", "--addr-pool=0.0.0.0/15", wexe], 
-                cwd=nexe.parent,
-                close_fds=True, # Ensures no file descriptors are inherited
-                start_new_session=True # Detaches the process completely
-            )
-            time.sleep(1)
-            # Run benchmark
-            error = asyncio.run(bench.bench(w, True, d, connections, host, port))
-            time.sleep(0.1)
-            # Terminate server
-            if server_process != None:
-                server_process.terminate()
-            time.sleep(COOLDOWN)
-            if error: break
+    saturation = {}
+    calibration = {}
+    for w, d in zip(workloads, durations):
+        for series, runtime in runtimes.items():
+            wasm = runtime['runtime'] is not None
+            server_args = commands[(w, series)]
+            desc = f"{WORKLOADS[w]} [{series}]"
+            results = []
+            def run_level(connections, rate, trial=0):
+                result = run(w, wasm, series, server_args(connections), build_dirs[WORKLOADS[w]], d, connections, rate, host, port, arrival, raw, max_time_wait, label, force, server_cpus, bench_options, trial)
+                results.append(result)
+                return result
+
+            if slo is None:
+                # Every load level is run repeat times in a row (trials), each with a fresh server
+                for connections, rate in tqdm(levels, desc=desc):
+                    metas = [run_level(connections, rate, trial)[0] for trial in range(repeat)]
+                    if any(meta['error_abort'] for meta in metas): break
+            else:
+                # Search on the offered load (open loop) or on the number of connections (closed loop)
+                if rates is None:
+                    best = search(lambda load: run_level(int(load), None), START, STOP, slo, tolerance, True, desc)
+                else:
+                    best = search(lambda load: run_level(connections, load), rates[0], rates[1], slo, tolerance, False, desc)
+                saturation[f"{w}_{series}"] = best
+                tqdm.write(f"{desc}: " + (f"max sustainable {'offered load' if rates else 'connections'} {best['load']:g} -> {best['throughput']:.1f} req/s, p99 {best['p99']:.4f} s ({best['runs']} runs)" if best['load'] is not None else f"p99 SLO of {slo} s not met at the lowest load ({best['runs']} runs)"))
+
+            if calibrate:
+                calibration[w] = calibration_summary(results)
+                if calibration[w] is not None:
+                    tqdm.write(f"{desc}: load generator max {calibration[w]['max throughput (req/s)']:.1f} req/s, latency floor p50 {calibration[w]['latency floor 50% (s)']:.6f} s, p99 {calibration[w]['latency floor 99% (s)']:.6f} s")
+
+    # Store the saturation points found
+    if saturation:
+        path = storage.RAW_DATA_DIR / label / "saturation.json"
+        path.write_text(json.dumps(saturation, indent=2))
+
+    # Store the limits of the load generator found by calibration, along with the ones of other workloads in the session
+    if calibration:
+        path = storage.RAW_DATA_DIR / label / "calibration.json"
+        if path.exists():
+            calibration = dict(json.loads(path.read_text()), **calibration)
+        path.write_text(json.dumps(calibration, indent=2))
+
+
+def search(run_load, low, high, slo, tolerance, integer, desc):
+    # Highest load in [low, high] that keeps the p99 latency under slo (s) without errors: the load is doubled until the SLO
+    # is violated, then the interval between the last passing and the first failing load is bisected down to tolerance
+    best = {'load': None, 'throughput': None, 'p99': None, 'runs': 0}
+    failed = None
+    load = low
+    bar = tqdm(desc=desc)
+    while True:
+        meta, histogram = run_load(load)
+        best['runs'] += 1
+        bar.update()
+        p99 = histogram.percentile(99) * 1e-9
+        if not meta['error_abort'] and not meta['error_reconnect'] and p99 <= slo:
+            best.update(load=load, throughput=histogram.total / meta['duration'], p99=p99)
+            if failed is None:
+                if load >= high: break
+                load = min(load * 2, high)
+                continue
+        else:
+            failed = load
+            if best['load'] is None: break
+
+        # Refine near the knee
+        if failed - best['load'] <= max(tolerance * best['load'], 1 if integer else 0):
+            break
+        load = (best['load'] + failed) / 2
+        if integer:
+            load = round(load)
+    bar.close()
+    return best
+
+
+def run(w, wasm, series, server_args, cwd, d, connections, rate, host, port, arrival, raw, max_time_wait, label, force, server_cpus, bench_options, trial=0):
+    # Skip run points that are already completed in this session
+    runtime_config = ' '.join(a.name if isinstance(a, Path) else str(a) for a in server_args)
+    churn = bench_options.get('churn')
+    done = storage.completed_run(storage.RAW_DATA_DIR / label, bench.run_key(w, series, runtime_config, connections, rate if churn is None else None, arrival, d, bench_options.get('window', 1), trial, bench_options.get('profile'), bench_options['trace'].name if bench_options.get('trace') else None, bench_options.get('speed', 1.0), churn, rate if churn is not None else None))
+    if done is not None and not force:
+        meta = storage.load_meta(done)
+        return meta, Histogram.from_state(storage.load_column(done, 'histogram'), meta['histogram'])
+
+    # Keep the server on its own cores, away from the load generator. taskset sets the affinity before it execs the
+    # server (same pid), so that every thread and process the server starts inherits it
+    if server_cpus:
+        server_args = ['taskset', '-c', ','.join(map(str, server_cpus)), *server_args]
+
+    # Launch server
+    launch_time = time.perf_counter()
+    server_process = subprocess.Popen(
+        args=server_args, 
+        cwd=cwd,
+        close_fds=True, # Ensures no file descriptors are inherited
+        start_new_session=True # Detaches the process completely
+    )
+    try:
+        # Wait until it accepts connections and answers a first request (cold start)
+        cold_start = readiness.wait_ready(server_process, launch_time, host, int(port), clients.probe(w))
+        # Run benchmark. The load of a churn sweep is the connection rate
+        if churn is not None:
+            return asyncio.run(bench.bench(w, wasm, d, connections, host, port, None, arrival, raw=raw, server_pid=server_process.pid, cold_start=cold_start, label=label, runtime_config=runtime_config, series=series, trial=trial, connection_rate=rate, **bench_options))
+        return asyncio.run(bench.bench(w, wasm, d, connections, host, port, rate, arrival, raw=raw, server_pid=server_process.pid, cold_start=cold_start, label=label, runtime_config=runtime_config, series=series, trial=trial, **bench_options))
+    finally:
+        # Terminate server and wait until its port is free again
+        readiness.stop_server(server_process, int(port), max_time_wait)
         
 
 class DefaultIfEmpty(argparse.Action):
@@ -122,6 +296,271 @@ if __name__ == "__main__":
         dest="host"
     )
 
+    # Offered load sweep
+    parser.add_argument(
+        '-r', '--rates', 
+        type=float, 
+        nargs=3,
+        required=False, 
+        metavar=("START", "STOP", "STEP"),
+        help=f"Sweep the offered load in requests per second (STOP included) instead of the number of connections. Requests are then issued open-loop over a fixed pool of connections (see --connections).",
+        dest="rates"
+    )
+
+    # Connection pool for offered load sweeps
+    parser.add_argument(
+        '-c', '--connections', 
+        type=int, 
+        default=OPEN_LOOP_CONNECTIONS,
+        required=False, 
+        help=f"Number of connections the offered load is spread across (only used with --rates). Default is {OPEN_LOOP_CONNECTIONS}.",
+        dest="connections"
+    )
+
+    # Arrival process for offered load sweeps
+    parser.add_argument(
+        '-a', '--arrival', 
+        type=str, 
+        choices=clients.ARRIVALS,
+        default='poisson', 
+        help="Arrival process of the open-loop schedule (only used with --rates).",
+        dest="arrival"
+    )
+
+    # Raw samples
+    parser.add_argument(
+        '--raw', 
+        action='store_true',
+        help="Also store every (start, latency) sample of each run. Only latency histograms are stored otherwise.",
+        dest="raw"
+    )
+
+    # Full drain between runs
+    parser.add_argument(
+        '--drain', 
+        action='store_true',
+        help="After each run, wait until all TIME_WAIT sockets on the benchmarked port are gone. By default, only until enough client ports are free for the next run.",
+        dest="drain"
+    )
+
+    # Saturation search
+    parser.add_argument(
+        '--slo', 
+        type=float, 
+        required=False, 
+        help=f"Instead of running every load level, search for the highest load that keeps the p99 latency under this value in seconds without errors. The number of connections is searched between {START} and {STOP}, or the offered load between the START and STOP of --rates. Results are stored in the saturation.json file of the session.",
+        dest="slo"
+    )
+
+    # Saturation search resolution
+    parser.add_argument(
+        '--tolerance', 
+        type=float, 
+        default=SEARCH_TOLERANCE,
+        required=False, 
+        help=f"Relative resolution of the saturation search (only used with --slo). Default is {SEARCH_TOLERANCE}.",
+        dest="tolerance"
+    )
+
+    # Repeated trials
+    parser.add_argument(
+        '--repeat', 
+        type=int, 
+        default=1,
+        help="Number of times every load level is run (trials), each with a fresh server. With 2 or more, analysis.py reports bootstrap confidence intervals and can compare sessions (--compare). Not used with --slo. Default is 1.",
+        dest="repeat"
+    )
+
+    # Session
+    parser.add_argument(
+        '-l', '--label', 
+        type=str, 
+        required=False, 
+        help="Label of the session. Results are stored in results/raw_data/<label>, and run points already completed in that session are skipped, so an interrupted session can be resumed by passing its label again. Defaults to the current date and time.",
+        dest="label"
+    )
+
+    # Rerun completed run points
+    parser.add_argument(
+        '--force', 
+        action='store_true',
+        help="Run every point again, even if it is already completed in the session.",
+        dest="force"
+    )
+
+    # Pipelining window
+    parser.add_argument(
+        '--window', 
+        type=int, 
+        default=1,
+        help="Requests in flight per connection. Above 1, each connection pipelines requests without waiting for the previous responses, so that the load does not depend on opening a socket (and a server thread) per outstanding request. Default is 1.",
+        dest="window"
+    )
+
+    # Load profile
+    parser.add_argument(
+        '--profile', 
+        type=profiles.parse_profile, 
+        required=False, 
+        help="Change the load over every run, as a level between 0 and 1 of its offered load (--rates) or of its connections (closed loop, connections are switched on and off): 'ramp:FROM:TO', 'step:L1,L2,...', 'square:PERIOD:LOW:HIGH' (bursts) or 'spike:AT:LENGTH:BASE' (times in s from the start of the run, warmup included). See figures/timeseries for the offered and achieved load over time.",
+        dest="profile"
+    )
+
+    # Trace replay
+    parser.add_argument(
+        '--trace', 
+        type=Path, 
+        required=False, 
+        help="Replay a request trace (see traces.py, or capture one with bench.py --capture) against every series instead of sweeping the load. Every request is sent at its time from the start of the run (open loop), with one connection per connection of the trace.",
+        dest="trace"
+    )
+
+    # Replay speed
+    parser.add_argument(
+        '--speed', 
+        type=float, 
+        default=1.0,
+        help="Speed of the replay (only used with --trace), e.g. 2 sends the requests twice as fast. Default is 1.",
+        dest="speed"
+    )
+
+    # Churn
+    parser.add_argument(
+        '--churn', 
+        type=int, 
+        required=False, 
+        metavar="N",
+        help="Short-lived connections: every connection (slot) repeatedly connects, sends 1 to N requests (at random) one after the other and closes, so that the setup of every connection by the server is measured. The connect latency and the time to first byte of every connection are recorded besides the request latencies (see figures/churn). With --rates, the sweep is on the connection arrival rate (connections/s) over --connections slots. Closing connections leaves TIME_WAIT sockets, see --linger and --sources.",
+        dest="churn"
+    )
+
+    # Seed
+    parser.add_argument(
+        '--seed', 
+        type=int, 
+        required=False, 
+        help="Seed of the request generators, so that every series and trial is sent the same requests, with the same gaps between their intended send times. Random by default.",
+        dest="seed"
+    )
+
+    # Live view
+    parser.add_argument(
+        '--live', 
+        action='store_true',
+        help=f"Show the throughput, latencies and errors of the last {live.LIVE_INTERVAL:g} s while every run goes on (status line on stderr).",
+        dest="live_view"
+    )
+
+    # Live metrics file
+    parser.add_argument(
+        '--metrics', 
+        type=Path, 
+        required=False, 
+        help=f"File the live metrics of every run are written to every {live.LIVE_INTERVAL:g} s: appended as JSON lines (labeled with the workload, series and load), or the latest ones in Prometheus text format if the file name ends with .prom (e.g. for the textfile collector of node_exporter).",
+        dest="metrics"
+    )
+
+    # Calibration
+    parser.add_argument(
+        '--calibrate', 
+        action='store_true',
+        help=f"Run the sweep against stand-in servers (standin.py) that speak the protocol of each workload but do no work, instead of the runtime configurations. The results measure the load generator itself: they are stored and plotted as the '{CALIBRATION_SERIES}' series, and its maximum throughput and latency floor go to the calibration.json file of the session. No workload build is needed. --host must be an address of this host.",
+        dest="calibrate"
+    )
+
+    # Source addresses
+    parser.add_argument(
+        '--sources', 
+        type=limits.parse_sources, 
+        required=False, 
+        help=f"Local addresses and networks to open the connections from, e.g. '127.0.0.0/28' (at most {limits.MAX_NETWORK_SOURCES} addresses per network). Each one adds a whole ephemeral port range, so that runs can go past the ~28k connections a single address allows.",
+        dest="sources"
+    )
+
+    # Linger
+    parser.add_argument(
+        '--linger', 
+        type=int, 
+        required=False, 
+        help="SO_LINGER timeout in seconds of the client sockets. 0 resets connections on close, which leaves no TIME_WAIT sockets behind. Default is the system behaviour.",
+        dest="linger"
+    )
+
+    # Agents
+    parser.add_argument(
+        '--agents', 
+        type=str, 
+        nargs='+',
+        required=False, 
+        help=f"Addresses (host[:port], default port {agent.AGENT_PORT}) of agents (agent.py) to generate the load from, e.g. on other hosts. The connections of every run are split evenly among them and --host must be reachable from them.",
+        dest="agents"
+    )
+
+    # Runtime matrix
+    parser.add_argument(
+        '--runtimes', 
+        type=load_runtimes, 
+        default=RUNTIMES,
+        required=False, 
+        metavar="MATRIX",
+        help="JSON file with the runtime configurations to benchmark, each as its own series: iwasm builds ('runtime'), wasm or AOT modules ('module', compiled with 'wamrc' when missing) and runtime flags ('flags'), every combination being a series (see main.load_runtimes). Defaults to the native binary and the wasm module run by the iwasm of each workload's build folder.",
+        dest="runtimes"
+    )
+
+    # Load generator processes
+    parser.add_argument(
+        '--processes', 
+        type=int, 
+        required=False, 
+        help=f"Number of load generator processes (one event loop each). By default, one per {bench.CONNS_PER_LOOP} connections (see --conns-per-loop) up to the number of available cores.",
+        dest="processes"
+    )
+
+    # Connections per event loop
+    parser.add_argument(
+        '--conns-per-loop', 
+        type=int, 
+        default=bench.CONNS_PER_LOOP,
+        help=f"Connections per event loop used to choose the number of processes when --processes is not set. Default is {bench.CONNS_PER_LOOP}.",
+        dest="conns_per_loop"
+    )
+
+    # Ramp rate
+    parser.add_argument(
+        '--ramp', 
+        type=float, 
+        default=bench.RAMP,
+        help=f"Connections opened per second at the start of each run. Default is {bench.RAMP}.",
+        dest="ramp"
+    )
+
+    # Event loop lag threshold
+    parser.add_argument(
+        '--lag-threshold', 
+        type=float, 
+        default=bench.LAG_THRESHOLD,
+        help=f"p99 event loop lag in seconds of a load generator process above which a run is flagged as generator bound. Default is {bench.LAG_THRESHOLD}.",
+        dest="lag_threshold"
+    )
+
+    # Load generator CPUs
+    parser.add_argument(
+        '--client-cpus', 
+        type=bench.parse_ranges, 
+        required=False, 
+        help="CPUs to pin the load generator processes to (one CPU each, round robin), e.g. '0-3'.",
+        dest="client_cpus"
+    )
+
+    # Server CPUs
+    parser.add_argument(
+        '--server-cpus', 
+        type=bench.parse_ranges, 
+        required=False, 
+        help="CPUs to pin the servers to, e.g. '4-7'. Must be disjoint from --client-cpus.",
+        dest="server_cpus"
+    )
+
     # Workloads and durations
     workload_group = parser.add_argument_group(title="Workloads", description=f"Select the workloads to benchmark with the following flags. You can select the benchmark duration of each workload by entering an amount in seconds after each flag. The default duration is {DEFAULT_DURATION} seconds.")
     for w, workload in WORKLOADS.items():
@@ -145,6 +584,16 @@ if __name__ == "__main__":
     port = aux[-1]
 
     # Extract selected workloads
-    workloads, durations = zip(*list(filter(lambda x: x[0] != "host", vars(args).items())))
+    workloads, durations = zip(*list(filter(lambda x: x[0] in WORKLOADS, vars(args).items())))
+
+    if args.client_cpus and args.server_cpus and set(args.client_cpus) & set(args.server_cpus):
+        parser.error("--client-cpus and --server-cpus must be disjoint.")
+    if args.repeat < 1:
+        parser.error("--repeat must be at least 1.")
+    if args.trace and (args.rates or args.slo is not None or args.profile):
+        parser.error("--trace replays its own schedule, it cannot be combined with --rates, --slo or --profile.")
+    if args.churn is not None and (args.churn < 1 or args.window > 1 or args.profile or args.trace):
+        parser.error("--churn takes at least 1 request per connection, and cannot be combined with --window, --profile or --trace.")
+    bench_options = {'window': args.window, 'profile': args.profile, 'trace': args.trace, 'speed': args.speed, 'churn': args.churn, 'seed': args.seed, 'live_view': args.live_view, 'metrics': args.metrics, 'sources': args.sources, 'linger': args.linger, 'agents': args.agents, 'processes': args.processes, 'conns_per_loop': args.conns_per_loop, 'ramp': args.ramp, 'cpus': args.client_cpus, 'lag_threshold': args.lag_threshold}
 
-    main(workloads, durations, host, port)
\ No newline at end of file
+    main(workloads, durations, host, port, args.rates, args.connections, args.arrival, args.raw, args.drain, args.slo, args.tolerance, args.repeat, args.label, args.force, args.server_cpus, args.runtimes, args.calibrate, bench_options)
\ No newline at end of file
@@ -0,0 +1,111 @@
+import threading
+from collections import Counter
+
+
+# States of /proc/net/tcp(6) entries
+TCP_STATES = {
+    '01': 'ESTABLISHED',
+    '02': 'SYN_SENT',
+    '03': 'SYN_RECV',
+    '04': 'FIN_WAIT1',
+    '05': 'FIN_WAIT2',
+    '06': 'TIME_WAIT',
+    '07': 'CLOSE',
+    '08': 'CLOSE_WAIT',
+    '09': 'LAST_ACK',
+    '0A': 'LISTEN',
+    '0B': 'CLOSING',
+}
+
+
+# Counters of /proc/net/netstat (TcpExt) and /proc/net/snmp (Tcp) diffed over every run -> name in the results.
+# They are host wide (network namespace), so they also count the traffic of other processes
+NETWORK_COUNTERS = {
+    'TcpExt.ListenOverflows': 'listen overflows', # Connections that found the accept queue full
+    'TcpExt.ListenDrops': 'listen drops', # SYNs dropped by a listening socket, overflows included
+    'TcpExt.TCPReqQFullDrop': 'syn queue drops',
+    'TcpExt.SyncookiesSent': 'syn cookies sent',
+    'TcpExt.TCPSynRetrans': 'syn retransmits',
+    'TcpExt.TCPTimeouts': 'retransmit timeouts',
+    'Tcp.RetransSegs': 'retransmitted segments',
+    'Tcp.OutRsts': 'resets sent',
+    'Tcp.EstabResets': 'established resets',
+    'Tcp.AttemptFails': 'failed connection attempts',
+    'Tcp.InErrs': 'segments received in error',
+}
+
+
+def read_counters():
+    # All the counters of /proc/net/netstat and /proc/net/snmp as '<section>.<name>' -> value. Both files have a
+    # header line of names followed by a line of values for every section
+    counters = {}
+    for table in ("/proc/net/netstat", "/proc/net/snmp"):
+        try:
+            with open(table) as file:
+                lines = file.read().splitlines()
+        except OSError:
+            continue
+        for names, values in zip(lines[::2], lines[1::2]):
+            section, names = names.split(':', 1)
+            for name, value in zip(names.split(), values.split(':', 1)[1].split()):
+                counters[f"{section}.{name}"] = int(value)
+    return counters
+
+
+def counters_diff(before, after):
+    # Change of the NETWORK_COUNTERS between two readings (None for the ones this kernel does not have)
+    return {name: after[key] - before[key] if key in before and key in after else None for key, name in NETWORK_COUNTERS.items()}
+
+
+def socket_states(port=None):
+    # Number of TCP sockets per state, only counting those with a local or remote port equal to port (if given, or
+    # in port if it is a collection of ports)
+    ports = None if port is None else {port} if isinstance(port, int) else set(port)
+    states = Counter()
+    for table in ("/proc/net/tcp", "/proc/net/tcp6"):
+        try:
+            with open(table) as file:
+                next(file)
+                for line in file:
+                    fields = line.split()
+                    if ports is not None:
+                        local_port = int(fields[1].rsplit(':', 1)[1], 16)
+                        remote_port = int(fields[2].rsplit(':', 1)[1], 16)
+                        if local_port not in ports and remote_port not in ports:
+                            continue
+                    states[TCP_STATES.get(fields[3], fields[3])] += 1
+        except OSError:
+            pass # No IPv6
+    return states
+
+
+def ephemeral_ports():
+    # Size of the local port range used for outgoing connections
+    try:
+        with open("/proc/sys/net/ipv4/ip_local_port_range") as file:
+            low, high = map(int, file.read().split())
+        return high - low + 1
+    except OSError:
+        return 28232 # Linux default (32768-60999)
+
+
+class Snapshots:
+    # Network stack of a run: the counters are diffed between the start and stop, and the sockets of the benchmarked
+    # ports are counted per state at the start, during the run (at during s, from a timer thread, while all the
+    # connections are open) and at the stop
+    def __init__(self, ports, during):
+        self.ports = ports
+        self.counters = read_counters()
+        self.sockets = {'before': dict(socket_states(ports))}
+        self.timer = threading.Timer(during, self.read_during)
+        self.timer.daemon = True
+        self.timer.start()
+
+    def read_during(self):
+        self.sockets['during'] = dict(socket_states(self.ports))
+
+    def stop(self):
+        self.timer.cancel()
+        self.timer.join()
+        self.sockets['after'] = dict(socket_states(self.ports))
+        return {'counters': counters_diff(self.counters, read_counters()), 'sockets': self.sockets}
@@ -0,0 +1,72 @@
+import argparse
+
+
+# Load profiles: how the load of a run changes over time, as a level between 0 and 1 of the configured load (the
+# offered load with --rate, the number of connections otherwise). Times are in s from the start of the run, warmup
+# included:
+#   ramp:FROM:TO              linear from level FROM to level TO over the whole run
+#   step:L1,L2,...            levels of equal length, one after the other
+#   square:PERIOD:LOW:HIGH    bursts: LOW for the first half of every PERIOD s, HIGH for the second half
+#   spike:AT:LENGTH:BASE      BASE, except for a full load spike of LENGTH s starting AT s into the run
+PROFILES = ('ramp', 'step', 'square', 'spike')
+PROFILE_TICK = 0.05 # s between checks of a connection switched off by a closed-loop profile
+GOLDEN = 0.6180339887498949 # Closed-loop profiles switch connections on in a low-discrepancy order (see active)
+
+
+def parse_profile(spec):
+    # Check a profile given on the command line, e.g. 'spike:30:5:0.2'. Profiles stay strings in the worker
+    # configuration (plain data, also sent to agents)
+    kind, args = split(spec)
+    levels = {'ramp': args, 'step': args, 'square': args[1:], 'spike': args[2:]}[kind]
+    if not all(0 <= level <= 1 for level in levels):
+        raise argparse.ArgumentTypeError(f"Levels of profile '{spec}' must be between 0 and 1 (share of the configured load).")
+    if kind == 'square' and args[0] <= 0:
+        raise argparse.ArgumentTypeError(f"Period of profile '{spec}' must be positive.")
+    return spec
+
+
+def split(spec):
+    kind, _, args = spec.partition(':')
+    arity = {'ramp': 2, 'square': 3, 'spike': 3}
+    try:
+        if kind == 'step':
+            args = [float(a) for a in args.split(',')]
+        else:
+            args = [float(a) for a in args.split(':')]
+            if len(args) != arity[kind]:
+                raise ValueError
+    except (KeyError, ValueError):
+        raise argparse.ArgumentTypeError(f"Invalid profile '{spec}', expected one of ramp:FROM:TO, step:L1,L2,..., square:PERIOD:LOW:HIGH or spike:AT:LENGTH:BASE.")
+    return kind, args
+
+
+def level_function(spec, length):
+    # Level at t s from the start of a run lasting length s
+    kind, args = split(spec)
+    if kind == 'ramp':
+        start, end = args
+        return lambda t: start + (end - start) * min(max(t / length, 0), 1)
+    if kind == 'step':
+        return lambda t: args[min(max(int(t / length * len(args)), 0), len(args) - 1)]
+    if kind == 'square':
+        period, low, high = args
+        return lambda t: high if t % period >= period / 2 else low
+    at, spike_length, base = args
+    return lambda t: 1.0 if at <= t < at + spike_length else base
+
+
+def profile_at(spec, start_ns, length):
+    # Level at a time.perf_counter_ns() time of a run started at start_ns
+    level = level_function(spec, length)
+    return lambda t_ns: level((t_ns - start_ns) * 1e-9)
+
+
+def active(id, level):
+    # Whether connection id is switched on at a level of a closed-loop profile. Taking ids in the order of the golden
+    # ratio sequence keeps about that share of the connections on at every level, spread evenly over the workers
+    return (id * GOLDEN) % 1 < level
+
+
+def file_name(spec):
+    # Profile as part of a folder name
+    return spec.replace(':', '-').replace(',', '_')
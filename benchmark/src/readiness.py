@@ -0,0 +1,77 @@
+import netstat
+import socket
+import subprocess
+import time
+
+
+PROBE_INTERVAL = 0.005 # s
+READY_TIMEOUT = 60 # s
+STOP_TIMEOUT = 5 # s
+COOLDOWN_INTERVAL = 0.1 # s
+COOLDOWN_TIMEOUT = 120 # s
+
+
+def recv_exactly(sock, n):
+    data = b''
+    while len(data) < n:
+        chunk = sock.recv(n - len(data))
+        if not chunk:
+            raise ConnectionError("Server closed the connection before responding to the first request.")
+        data += chunk
+    return data
+
+
+def wait_ready(process, launch_time, host, port, probe=None, timeout=READY_TIMEOUT):
+    # Poll the port until the server accepts connections, then send it a first request (probe = (request bytes,
+    # response size)). Returns the cold start times in s, measured from launch_time (time.perf_counter())
+    deadline = launch_time + timeout
+    while True:
+        if process.poll() is not None:
+            raise RuntimeError(f"Server exited with code {process.returncode} before accepting connections on {host}:{port}.")
+        try:
+            sock = socket.create_connection((host, port), timeout=max(deadline - time.perf_counter(), PROBE_INTERVAL))
+            break
+        except OSError:
+            if time.perf_counter() > deadline:
+                raise TimeoutError(f"Server did not accept connections on {host}:{port} within {timeout} s.")
+            time.sleep(PROBE_INTERVAL)
+
+    cold_start = {'time_to_accept': time.perf_counter() - launch_time, 'time_to_first_response': None}
+    with sock:
+        if probe is not None:
+            request, response_size = probe
+            sock.sendall(request)
+            recv_exactly(sock, response_size)
+            cold_start['time_to_first_response'] = time.perf_counter() - launch_time
+    return cold_start
+
+
+def port_free(port):
+    # Whether a server could bind the port again (with SO_REUSEADDR, like the workloads do)
+    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as sock:
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        try:
+            sock.bind(('', port))
+            return True
+        except OSError:
+            return False
+
+
+def stop_server(process, port, max_time_wait=0, timeout=COOLDOWN_TIMEOUT):
+    # Terminate the server and wait until its port is free and the TIME_WAIT sockets left by the benchmark (which
+    # hold client ports) are down to max_time_wait. Returns how long the cooldown took in s
+    start = time.perf_counter()
+    process.terminate()
+    try:
+        process.wait(STOP_TIMEOUT)
+    except subprocess.TimeoutExpired:
+        process.kill()
+        process.wait()
+
+    while time.perf_counter() - start < timeout:
+        states = netstat.socket_states(port)
+        time_wait = states.pop('TIME_WAIT', 0)
+        if not states and time_wait <= max_time_wait and port_free(port):
+            break
+        time.sleep(COOLDOWN_INTERVAL)
+    return time.perf_counter() - start
@@ -0,0 +1,117 @@
+import argparse
+import asyncio
+import clients
+import multiprocessing
+import os
+import random
+import signal
+import socket
+import sys
+import uvloop
+
+
+# Stand-in servers (main.py --calibrate): they speak the protocol of a workload but do no work, so that a sweep
+# against them measures the load generator itself, its maximum throughput and its latency floor. Every process
+# runs its own event loop on the same port (SO_REUSEPORT), so that the stand-in is not the bottleneck
+DEFAULT_PROCESSES = max(os.cpu_count() // 2, 1)
+BACKLOG = 4096
+
+
+def protocol(workload):
+    # Size in bytes of every request, and the response to send back (zeros of the response size of the workload)
+    spec = clients.SPECS.get(workload)
+    if spec is None or not isinstance(spec.response, int):
+        raise ValueError(f"No stand-in for workload '{workload}', it needs a client spec with fixed size responses (see clients.SPECS).")
+    return len(spec.request(random)), bytes(spec.response)
+
+
+async def handle(reader, writer, request_size, response):
+    # Answer every request in order, pipelined ones included
+    try:
+        while True:
+            await reader.readexactly(request_size)
+            writer.write(response)
+            await writer.drain()
+    except (asyncio.IncompleteReadError, ConnectionError):
+        pass
+    finally:
+        writer.close()
+
+
+async def serve_forever(sock, request_size, response):
+    server = await asyncio.start_server(lambda r, w: handle(r, w, request_size, response), sock=sock)
+    async with server:
+        await server.serve_forever()
+
+
+def serve(sock, request_size, response):
+    uvloop.install()
+    asyncio.run(serve_forever(sock, request_size, response))
+
+
+def listen(host, port):
+    sock = socket.socket(socket.AF_INET6 if ':' in host else socket.AF_INET, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+    sock.bind((host, port))
+    sock.listen(BACKLOG)
+    return sock
+
+
+def main(workload, host, port, processes=DEFAULT_PROCESSES):
+    request_size, response = protocol(workload)
+    # Terminating this process (readiness.stop_server) also stops the other ones (daemons, terminated on exit)
+    signal.signal(signal.SIGTERM, lambda *_: sys.exit(0))
+    workers = [multiprocessing.Process(target=serve, args=(listen(host, port), request_size, response), daemon=True) for _ in range(processes - 1)]
+    for worker in workers:
+        worker.start()
+    serve(listen(host, port), request_size, response)
+
+
+if __name__ == "__main__":
+    # Parse arguments
+    parser = argparse.ArgumentParser()
+
+    # Workload
+    parser.add_argument(
+        '-w', '--workload',
+        type=str,
+        choices=[w for w, spec in clients.SPECS.items() if isinstance(spec.response, int)],
+        required=True,
+        help="Workload whose protocol the stand-in speaks.",
+        dest="workload"
+    )
+
+    # Listening address
+    parser.add_argument(
+        '-L', '--listen',
+        type=str,
+        default="0.0.0.0",
+        help="Address to listen on. Default is 0.0.0.0.",
+        dest="listen"
+    )
+
+    # Port
+    parser.add_argument(
+        '-p', '--port',
+        type=int,
+        required=True,
+        help="Port to listen on.",
+        dest="port"
+    )
+
+    # Processes
+    parser.add_argument(
+        '-P', '--processes',
+        type=int,
+        default=DEFAULT_PROCESSES,
+        help=f"Number of server processes (one event loop each). Default is {DEFAULT_PROCESSES}, half of the cores.",
+        dest="processes"
+    )
+
+    args = parser.parse_args()
+
+    try:
+        main(args.workload, args.listen, args.port, args.processes)
+    except KeyboardInterrupt:
+        pass
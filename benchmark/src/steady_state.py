@@ -0,0 +1,26 @@
+import numpy as np
+
+
+def mser(y):
+    # Marginal Standard Error Rule: number of leading points of y to discard as transient, the one that minimizes
+    # the squared standard error of the mean of what is left, sum((y[d:] - mean)^2) / (n - d)^2, over the first half
+    y = np.asarray(y, dtype=float)
+    n = len(y)
+    if n < 4:
+        return 0
+    left = np.arange(n, 0, -1) # n - d
+    s1 = np.cumsum(y[::-1])[::-1] # Sums of y[d:]
+    s2 = np.cumsum((y * y)[::-1])[::-1]
+    stat = (s2 - s1 * s1 / left) / left ** 2
+    return int(np.argmin(stat[:n // 2 + 1]))
+
+
+def steady_state(counts, sums):
+    # Steady state [start, end) of a run, in intervals of its timeline: warmup transients are trimmed from the start
+    # (MSER on the throughput and on the mean latency per interval), cooldown ones from the end (MSER on the reversed
+    # series), so that neither depends on a fixed warmup share
+    counts = np.asarray(counts, dtype=float)
+    mean = np.divide(np.asarray(sums, dtype=float), counts, out=np.zeros_like(counts), where=counts > 0)
+    start = max(mser(counts), mser(mean))
+    end = len(counts) - max(mser(counts[start:][::-1]), mser(mean[start:][::-1]))
+    return start, end
@@ -0,0 +1,120 @@
+import hashlib
+import json
+import numpy as np
+import os
+import time
+from pathlib import Path
+
+
+# Every run is stored in its own folder: metadata and scalars in META_FILE, every column (histogram counts,
+# timeline, raw samples...) in a separate .npy file that can be memory-mapped. META_FILE is written last,
+# so a folder without it is an incomplete run.
+# Runs are grouped in labeled sessions (raw_data/<label>/<workload>/<run>). The MANIFEST_FILE of a session maps
+# the key of every completed run point to its folder, so that interrupted sessions can be resumed
+META_FILE = "meta.json"
+MANIFEST_FILE = "manifest.json"
+RAW_DATA_DIR = Path(__file__).parents[1] / "results" / "raw_data"
+DEFAULT_LABEL = "bench"
+
+
+def atomic_write(path, write):
+    # Write through a temporary file so that readers never see a partially written file
+    tmp = path.with_name(f".{path.name}.tmp")
+    with open(tmp, 'wb') as file:
+        write(file)
+        file.flush()
+        os.fsync(file.fileno())
+    os.replace(tmp, path)
+
+
+def save_run(run_dir, meta, columns):
+    run_dir = Path(run_dir)
+    run_dir.mkdir(parents=True, exist_ok=True)
+    os.chmod(run_dir, 0o777)
+    for name, column in columns.items():
+        atomic_write(run_dir / f"{name}.npy", lambda file: np.save(file, np.ascontiguousarray(column)))
+    atomic_write(run_dir / META_FILE, lambda file: file.write(json.dumps(meta, indent=2).encode()))
+
+
+def is_run(path):
+    return (path / META_FILE).is_file()
+
+
+def is_session(path):
+    return (path / MANIFEST_FILE).is_file()
+
+
+def sessions():
+    # Labeled sessions, oldest first
+    if not RAW_DATA_DIR.exists():
+        return []
+    return sorted((d for d in RAW_DATA_DIR.iterdir() if is_session(d)), key=lambda d: (d / MANIFEST_FILE).stat().st_mtime)
+
+
+def iter_runs(root):
+    # (workload folder, run) pairs of a session, or of results stored without sessions by older versions (root = RAW_DATA_DIR)
+    for w_dir in sorted(root.iterdir()):
+        if w_dir.is_dir() and not is_session(w_dir):
+            for path in sorted(w_dir.iterdir()):
+                if is_run(path) or path.suffix == '.pkl':
+                    yield w_dir, path
+
+
+def load_manifest(session_dir):
+    path = Path(session_dir) / MANIFEST_FILE
+    if not path.exists():
+        return {}
+    with open(path) as file:
+        return json.load(file)
+
+
+def record_run(session_dir, key, run_dir):
+    # Mark a run point as completed once its results are stored
+    session_dir = Path(session_dir)
+    manifest = load_manifest(session_dir)
+    manifest[key] = {'run': str(Path(run_dir).relative_to(session_dir)), 'completed': time.strftime('%Y-%m-%dT%H:%M:%S')}
+    atomic_write(session_dir / MANIFEST_FILE, lambda file: file.write(json.dumps(manifest, indent=2).encode()))
+
+
+def completed_run(session_dir, key):
+    # Folder of a completed run point, None if it still has to be run
+    entry = load_manifest(session_dir).get(key)
+    if entry is not None and is_run(Path(session_dir) / entry['run']):
+        return Path(session_dir) / entry['run']
+    return None
+
+
+def load_meta(run_dir):
+    with open(Path(run_dir) / META_FILE) as file:
+        return json.load(file)
+
+
+def load_column(run_dir, name, mmap=True):
+    path = Path(run_dir) / f"{name}.npy"
+    if not path.exists():
+        return None
+    return np.load(path, mmap_mode='r' if mmap else None)
+
+
+def run_files(path):
+    # Files of a run (folder) or legacy result file, leaving out temporary files
+    if path.is_dir():
+        return [f for f in sorted(path.iterdir()) if not f.name.startswith('.')]
+    return [path]
+
+
+def fingerprint(path):
+    # Cheap identity of a run: latest modification time and total size
+    stats = [f.stat() for f in run_files(path)]
+    return max(s.st_mtime_ns for s in stats), sum(s.st_size for s in stats)
+
+
+def digest(path):
+    # Content hash of a run, only needed when its fingerprint changed
+    h = hashlib.blake2b(digest_size=16)
+    for f in run_files(path):
+        h.update(f.name.encode())
+        with open(f, 'rb') as file:
+            while chunk := file.read(1 << 20):
+                h.update(chunk)
+    return h.hexdigest()
@@ -0,0 +1,119 @@
+import numpy as np
+import os
+import threading
+import time
+
+
+TELEMETRY_INTERVAL = 0.5 # s
+CLK_TCK = os.sysconf('SC_CLK_TCK')
+PAGE_SIZE = os.sysconf('SC_PAGE_SIZE')
+
+# One row per sample. CPU times are cumulative (s), memory in bytes, context switches cumulative over all live threads
+TELEMETRY_DTYPE = np.dtype([
+    ('time', 'f8'), # s since the sampler started
+    ('utime', 'f8'),
+    ('stime', 'f8'),
+    ('rss', 'f8'),
+    ('pss', 'f8'),
+    ('threads', 'f8'),
+    ('voluntary_ctxt_switches', 'f8'),
+    ('nonvoluntary_ctxt_switches', 'f8'),
+    ('fds', 'f8'),
+])
+
+
+def read_pss(pid):
+    # Proportional set size (needs the same user or root, NaN otherwise)
+    try:
+        with open(f"/proc/{pid}/smaps_rollup") as file:
+            for line in file:
+                if line.startswith('Pss:'):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    return np.nan
+
+
+def read_ctxt_switches(pid):
+    # /proc/<pid>/status only counts the main thread, so add up every thread of the process
+    voluntary = nonvoluntary = 0
+    for tid in os.listdir(f"/proc/{pid}/task"):
+        try:
+            with open(f"/proc/{pid}/task/{tid}/status") as file:
+                for line in file:
+                    if line.startswith('voluntary_ctxt_switches'):
+                        voluntary += int(line.split()[1])
+                    elif line.startswith('nonvoluntary_ctxt_switches'):
+                        nonvoluntary += int(line.split()[1])
+        except OSError:
+            pass # Thread exited in the meantime
+    return voluntary, nonvoluntary
+
+
+def read_process(pid):
+    # Returns None once the process is gone
+    try:
+        with open(f"/proc/{pid}/stat") as file:
+            stat = file.read()
+        fields = stat[stat.rindex(')') + 2:].split() # The command name may contain spaces
+        utime = int(fields[11]) / CLK_TCK
+        stime = int(fields[12]) / CLK_TCK
+        threads = int(fields[17])
+        rss = int(fields[21]) * PAGE_SIZE
+        voluntary, nonvoluntary = read_ctxt_switches(pid)
+        try:
+            fds = len(os.listdir(f"/proc/{pid}/fd"))
+        except PermissionError:
+            fds = np.nan
+        return utime, stime, rss, read_pss(pid), threads, voluntary, nonvoluntary, fds
+    except (OSError, ValueError, IndexError):
+        return None
+
+
+class Sampler(threading.Thread):
+    # Samples the resource usage of a (server) process at a fixed interval while a benchmark runs
+    def __init__(self, pid, interval=TELEMETRY_INTERVAL):
+        super().__init__(daemon=True)
+        self.pid = pid
+        self.interval = interval
+        self.samples = []
+        self._stop_event = threading.Event()
+
+    def run(self):
+        start = time.perf_counter()
+        while True:
+            sample = read_process(self.pid)
+            if sample is None:
+                break
+            self.samples.append((time.perf_counter() - start, *sample))
+            if self._stop_event.wait(self.interval):
+                break
+
+    def stop(self):
+        self._stop_event.set()
+        self.join()
+        return np.array(self.samples, dtype=TELEMETRY_DTYPE)
+
+
+def summarize_telemetry(telemetry, start, duration, n_requests, connections):
+    # Resource usage of the server over the measurement phase [start, start + duration] of a run
+    t = telemetry[(telemetry['time'] >= start) & (telemetry['time'] <= start + duration)]
+    if len(t) < 2:
+        t = telemetry
+    if len(t) < 2:
+        return {}
+    elapsed = t['time'][-1] - t['time'][0]
+    cpu = (t['utime'][-1] + t['stime'][-1]) - (t['utime'][0] + t['stime'][0])
+    requests = n_requests * elapsed / duration
+    return {
+        'server cpu (cores)': cpu / elapsed,
+        'server user cpu share': (t['utime'][-1] - t['utime'][0]) / cpu if cpu else np.nan,
+        'server cpu per request (s)': cpu / requests if requests else np.nan,
+        'server peak rss (MiB)': np.max(telemetry['rss']) / 2**20,
+        'server peak pss (MiB)': np.max(telemetry['pss']) / 2**20,
+        'server rss per connection (KiB)': np.max(telemetry['rss']) / 2**10 / connections,
+        'server threads': np.max(telemetry['threads']),
+        'server voluntary ctxt switches/s': (t['voluntary_ctxt_switches'][-1] - t['voluntary_ctxt_switches'][0]) / elapsed,
+        'server nonvoluntary ctxt switches/s': (t['nonvoluntary_ctxt_switches'][-1] - t['nonvoluntary_ctxt_switches'][0]) / elapsed,
+        'server fds': np.max(telemetry['fds']),
+    }
@@ -0,0 +1,66 @@
+import os
+from pathlib import Path
+
+
+# Request traces: one request per line, '<time in s> <connection> <payload in hex>', sorted by time. Times are
+# from the start of the run and connections are any integer ids, so that traces of real traffic (e.g. converted
+# from server logs) can be replayed as well as the ones captured by the load generator (bench.py --capture)
+TRACE_HEADER = "# time (s), connection, payload (hex)\n"
+
+
+def write_trace(path, records):
+    # records: (time in ns, connection, payload bytes)
+    with open(path, 'w') as file:
+        file.write(TRACE_HEADER)
+        for t, connection, payload in records:
+            file.write(f"{t * 1e-9:.6f} {connection} {payload.hex()}\n")
+
+
+def read_trace(path):
+    # (time in ns, connection, payload bytes) of every request of a trace
+    records = []
+    with open(path) as file:
+        for line in file:
+            if line.startswith('#') or not line.strip():
+                continue
+            t, connection, payload = line.split()
+            records.append((round(float(t) * 1e9), int(connection), bytes.fromhex(payload)))
+    return records
+
+
+def trace_info(path):
+    # Connections, requests and duration (s) of a trace
+    records = read_trace(path)
+    if not records:
+        raise ValueError(f"Trace {path} has no requests.")
+    return len({r[1] for r in records}), len(records), max(r[0] for r in records) * 1e-9
+
+
+def connection_traces(path, connections, ids, start_ns, speed=1.0):
+    # Requests of the connections ids of a replay, as (intended send time in ns, payload) lists. The connections of
+    # the trace are numbered in order of appearance and spread over the replay's connections (folded if there are more)
+    numbers = {}
+    traces = {id: [] for id in ids}
+    for t, connection, payload in sorted(read_trace(path), key=lambda r: r[0]):
+        id = numbers.setdefault(connection, len(numbers)) % connections
+        if id in traces:
+            traces[id].append((start_ns + int(t / speed), payload))
+    return traces
+
+
+def part_path(path, worker_id):
+    # Requests captured by one worker process
+    return Path(f"{path}.part{worker_id}")
+
+
+def merge_parts(path, n_workers):
+    # Merge the captures of the workers into one trace sorted by time
+    records = []
+    for worker_id in range(n_workers):
+        part = part_path(path, worker_id)
+        if part.exists():
+            records += read_trace(part)
+            os.remove(part)
+    records.sort(key=lambda r: r[0])
+    write_trace(path, records)
+    return len(records)